@@ -0,0 +1,97 @@
+"""
+Admission control - limit on concurrently active interviews with a fair FIFO waiting room
+
+When a participant accepts the consent form, their session asks the AdmissionController for a slot.
+Up to `max_active` sessions run the (model-heavy) flow at once; everyone else waits in a FIFO queue
+and sees their live position on the consent page until a slot frees up.
+
+Slots are held as leases: an active session renews its lease on every rerun and gives it back when it
+reaches the finalise step. Sessions whose tab was closed simply stop renewing -- their slot (or queue place)
+expires after `lease_seconds` (`queue_timeout` for waiting sessions, which poll every few seconds).
+A session that comes back after its lease was reclaimed has to queue for a slot again.
+
+The limit applies per process (one streamlit worker), configured in the [admission] secrets section.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class AdmissionController:
+    """Thread-safe admission gate shared by all sessions of a process.
+
+    Parameters:
+    max_active (int): number of sessions allowed in the interview / scenario part of the flow at once
+    lease_seconds (float): an active session that has not rerun for this long loses its slot
+    queue_timeout (float): a waiting session that has not polled for this long loses its place
+    """
+
+    def __init__(self, max_active=20, lease_seconds=900, queue_timeout=30):
+        self.max_active = max_active
+        self.lease_seconds = lease_seconds
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        self.active = {}                # session key -> last renewal
+        self.waiting = OrderedDict()    # session key -> last poll, in arrival order
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**{k: v for k, v in dict(config).items() if k in ('max_active', 'lease_seconds', 'queue_timeout')})
+
+    def try_admit(self, key):
+        """Asks for a slot -- enqueues the session on its first call.
+
+        Returns:
+        0 if the session is (now) admitted, otherwise its 1-based position in the waiting queue
+        """
+        now = time.monotonic()
+        with self.lock:
+            if key in self.active:
+                self.active[key] = now
+                return 0
+
+            self._expire(now)
+            self.waiting[key] = now
+            self._admit_from_queue(now)
+
+            if key in self.active:
+                return 0
+            return list(self.waiting).index(key) + 1
+
+    def renew(self, key):
+        """Keeps the lease of an active session alive (called on every rerun).
+
+        Returns:
+        False if the session no longer holds a slot (its lease expired and was reclaimed, or it was released)
+        """
+        with self.lock:
+            if key not in self.active:
+                return False
+            self.active[key] = time.monotonic()
+            return True
+
+    def release(self, key):
+        """Gives the slot back (or leaves the queue) and lets the next waiting session in."""
+        with self.lock:
+            self.active.pop(key, None)
+            self.waiting.pop(key, None)
+            self._admit_from_queue(time.monotonic())
+
+    def status(self):
+        with self.lock:
+            return {'active': len(self.active), 'waiting': len(self.waiting), 'max_active': self.max_active}
+
+    def _expire(self, now):
+        for key, renewed in list(self.active.items()):
+            if now - renewed > self.lease_seconds:
+                del self.active[key]
+        for key, polled in list(self.waiting.items()):
+            if now - polled > self.queue_timeout:
+                del self.waiting[key]
+
+    def _admit_from_queue(self, now):
+        # strictly first come, first served -- only the head of the queue can be admitted
+        while self.waiting and len(self.active) < self.max_active:
+            key, _ = self.waiting.popitem(last=False)
+            self.active[key] = now
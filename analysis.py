@@ -0,0 +1,284 @@
+"""
+Analysis - vectorised persona preference statistics over exported sessions
+
+Loads a session dataset (export_sessions.py output or the local results store -- same layout) into
+columnar arrays and computes, per persona, per display position and per persona x position:
+- thumbs: mean thumbs score of rated scenarios (collectFeedback)
+- selected: share of shown scenarios that were picked (click_selection_yes), over sessions with a pick
+- judgment: mean slider judgment of the picked scenario (sliderChange), on a 0 (Not really) .. 3 (Ready as is!) scale
+
+Confidence intervals come from a Poisson bootstrap over *sessions* (the three scenarios of a session are not
+independent), computed as weighted sums with matrix products -- no Python loop over sessions or replicates.
+Sessions only take a few thousand distinct combinations of persona order, thumbs, pick and judgment, so
+identical sessions are collapsed first (to_long) and each distinct session gets one Poisson(multiplicity) weight
+per replicate (the sum of m Poisson(1) weights) -- the same distribution, but neither the number of draws nor the
+matrix products grow with the number of sessions. All metrics of a table share one set of replicates.
+Order effects are the differences between a position's rate and the mean rate over positions
+(personas are shuffled over the columns, so these estimate the pure position effect), with the same bootstrap.
+
+Usage:
+    python analysis.py exports/sessions --since 2024-11-01 --n-boot 2000 --out persona_report.csv
+    python analysis.py --benchmark 300000      # times the whole report on synthetic sessions
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from results_store import read_sessions
+from session_records import N_COLUMNS
+
+
+# the slider options of reviewData, from worst to best
+JUDGMENT_SCALE = ["Not really", "Needs some edits", "Pretty good but I'd like to tweak it", "Ready as is!"]
+
+METRICS = ['thumbs', 'selected', 'judgment']
+
+# replicates are generated in chunks of at most this many weights, to keep memory flat for large exports
+BOOTSTRAP_CHUNK = 10**7
+
+
+def load_sessions(root, since=None, until=None):
+    """Reads the columns needed for the preference statistics into a DataFrame (one row per session).
+
+    Sessions are de-duplicated on (chat_id, timestamp) -- overlapping incremental exports can contain a session twice.
+    """
+    columns = (['chat_id', 'timestamp', 'selected_column', 'judgment']
+               + [f'persona_{i}' for i in range(1, N_COLUMNS + 1)]
+               + [f'thumbs_{i}' for i in range(1, N_COLUMNS + 1)])
+    sessions = read_sessions(root, columns, since=since, until=until).to_pandas()
+    sessions = sessions.drop_duplicates(subset=['chat_id', 'timestamp'], keep='last')
+    # sessions from before the persona order was stored can't be attributed
+    sessions = sessions.dropna(subset=[f'persona_{i}' for i in range(1, N_COLUMNS + 1)], how='all')
+    return sessions.reset_index(drop=True)
+
+
+def to_long(sessions):
+    """Stacks the per-column fields into flat arrays with one entry per shown scenario of each *distinct* session.
+
+    Returns:
+    dict of equally long numpy arrays: session (distinct session index), position (1-based), persona, and the
+    metric values `thumbs`, `selected`, `judgment` (NaN where the metric does not apply); plus `multiplicity`,
+    the number of sessions behind each distinct session
+    """
+    ## sessions with the same fields are interchangeable -- keep one of each, with how often it occurs
+    fields = (['selected_column', 'judgment'] + [f'persona_{i}' for i in range(1, N_COLUMNS + 1)]
+              + [f'thumbs_{i}' for i in range(1, N_COLUMNS + 1)])
+    pattern, _ = pd.factorize(pd.util.hash_pandas_object(sessions[fields], index=False))
+    _, first = np.unique(pattern, return_index=True)
+    multiplicity = np.bincount(pattern).astype(float)
+    sessions = sessions.iloc[first]
+
+    n = len(sessions)
+    positions = np.arange(1, N_COLUMNS + 1)
+
+    persona = np.column_stack([sessions[f'persona_{i}'].to_numpy(dtype=object) for i in positions]).ravel()
+    thumbs = np.column_stack([sessions[f'thumbs_{i}'].to_numpy(dtype=float, na_value=np.nan) for i in positions]).ravel()
+
+    ## the pick is only defined for sessions that got as far as choosing a scenario
+    picked = sessions['selected_column'].to_numpy(dtype=float, na_value=np.nan)
+    selected = (picked[:, None] == positions[None, :]).astype(float)
+    selected[np.isnan(picked)] = np.nan
+
+    judgment_index = pd.Categorical(sessions['judgment'].str.strip(), categories=JUDGMENT_SCALE).codes.astype(float)
+    judgment_index[judgment_index < 0] = np.nan
+    judgment = np.where(selected == 1, judgment_index[:, None], np.nan)
+
+    return {
+        'session': np.repeat(np.arange(n), N_COLUMNS),
+        'position': np.tile(positions, n),
+        'persona': persona,
+        'thumbs': thumbs,
+        'selected': selected.ravel(),
+        'judgment': judgment.ravel(),
+        'multiplicity': multiplicity,
+    }
+
+
+def session_sums(long, groups, metric):
+    """Per-session sums and counts of a metric for each group.
+
+    Parameters:
+    long (dict): as returned by to_long
+    groups (np.ndarray): integer group code per long entry (-1 for entries outside any group)
+    metric (str): one of METRICS
+
+    Returns:
+    (sums, counts) -- two (n_sessions x n_groups) arrays
+    """
+    values = long[metric]
+    valid = ~np.isnan(values) & (groups >= 0)
+    n_sessions = len(long['multiplicity'])
+    n_groups = groups.max() + 1 if len(groups) else 0
+    cell = long['session'][valid] * n_groups + groups[valid]
+    size = n_sessions * n_groups
+    sums = np.bincount(cell, weights=values[valid], minlength=size).reshape(n_sessions, n_groups)
+    counts = np.bincount(cell, minlength=size).reshape(n_sessions, n_groups).astype(float)
+    return sums, counts
+
+
+def bootstrap_ratios(sums, counts, multiplicity=None, contrasts=None, n_boot=1000, alpha=0.05, seed=0):
+    """Session-level Poisson bootstrap of sum(sums) / sum(counts) per group.
+
+    Parameters:
+    sums / counts (np.ndarray): (n_sessions x n_groups), see session_sums
+    multiplicity (np.ndarray): number of sessions behind each row (see to_long) -- 1 each if not given
+    contrasts (np.ndarray): optional (n_groups x k) matrix -- the rates are multiplied by it before the
+                            intervals are taken (e.g. differences between groups)
+    n_boot (int): number of bootstrap replicates
+    alpha (float): 1 - confidence level
+
+    Returns:
+    (estimate, low, high) arrays of length n_groups (or k with contrasts)
+    """
+    rng = np.random.default_rng(seed)
+    n_sessions = sums.shape[0]
+    multiplicity = np.ones(n_sessions) if multiplicity is None else multiplicity
+
+    def combine(total_sums, total_counts):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rates = total_sums / total_counts
+        return rates if contrasts is None else rates @ contrasts
+
+    estimate = combine(multiplicity @ sums, multiplicity @ counts)
+
+    ## each replicate re-weights whole sessions -- weights x (sessions x groups) is one matrix product per chunk
+    chunk = max(1, min(n_boot, BOOTSTRAP_CHUNK // max(n_sessions, 1)))
+    replicates = []
+    for start in range(0, n_boot, chunk):
+        weights = rng.poisson(multiplicity, size=(min(chunk, n_boot - start), n_sessions)).astype(np.float64)
+        replicates.append(combine(weights @ sums, weights @ counts))
+    replicates = np.concatenate(replicates)
+
+    low, high = np.nanpercentile(replicates, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return estimate, low, high
+
+
+def stacked_sums(long, groups):
+    """session_sums of every metric, side by side: two (n_sessions x n_metrics * n_groups) arrays."""
+    tables = [session_sums(long, groups, metric) for metric in METRICS]
+    return np.hstack([sums for sums, _ in tables]), np.hstack([counts for _, counts in tables])
+
+
+def preference_rates(long, by='persona', n_boot=1000, alpha=0.05, seed=0):
+    """Rates of every metric per persona, per position or per persona x position, with bootstrap intervals.
+
+    Parameters:
+    by (str): 'persona', 'position' or 'persona_position'
+
+    Returns:
+    DataFrame with one row per group and metric: n (observations), rate, low, high
+    """
+    if by == 'persona_position':
+        keys = pd.Series(long['persona']).astype(str) + ' @ ' + pd.Series(long['position']).astype(str)
+        keys = keys.where(pd.notna(long['persona'])).to_numpy(dtype=object)
+    else:
+        keys = long[by]
+    codes, labels = pd.factorize(keys, sort=True)
+
+    ## all metrics side by side (metric-major columns) -- one bootstrap for the whole table
+    sums, counts = stacked_sums(long, codes)
+    estimate, low, high = bootstrap_ratios(sums, counts, long['multiplicity'], n_boot=n_boot, alpha=alpha, seed=seed)
+    n = long['multiplicity'] @ counts
+
+    rows = []
+    for m, metric in enumerate(METRICS):
+        columns = slice(m * len(labels), (m + 1) * len(labels))
+        for label, n_obs, rate, lo, hi in zip(labels, n[columns], estimate[columns], low[columns], high[columns]):
+            rows.append({'group': label, 'metric': metric, 'n': int(n_obs), 'rate': rate, 'low': lo, 'high': hi})
+    return pd.DataFrame(rows)
+
+
+def order_effects(long, n_boot=1000, alpha=0.05, seed=0):
+    """Position effects: each position's rate minus the mean over positions, per metric, with bootstrap intervals.
+
+    Because personas are shuffled over the columns, a non-zero effect is a pure order (e.g. primacy) effect.
+    """
+    groups = long['position'] - 1
+    # contrast matrix: position rate - mean of all position rates
+    contrasts = np.eye(N_COLUMNS) - np.full((N_COLUMNS, N_COLUMNS), 1 / N_COLUMNS)
+
+    # the same contrasts within each metric's block of columns
+    sums, counts = stacked_sums(long, groups)
+    estimate, low, high = bootstrap_ratios(sums, counts, long['multiplicity'], contrasts=np.kron(np.eye(len(METRICS)), contrasts),
+                                           n_boot=n_boot, alpha=alpha, seed=seed)
+
+    rows = []
+    for m, metric in enumerate(METRICS):
+        for position in range(N_COLUMNS):
+            i = m * N_COLUMNS + position
+            rows.append({'position': position + 1, 'metric': metric, 'effect': estimate[i], 'low': low[i], 'high': high[i]})
+    return pd.DataFrame(rows)
+
+
+def synthetic_sessions(n, seed=0):
+    """n random sessions in the load_sessions layout (shuffled personas, some unrated / unpicked) -- for --benchmark."""
+    rng = np.random.default_rng(seed)
+    personas = np.array(['formal', 'youngsib', 'friend'], dtype=object)
+    order = np.argsort(rng.random((n, N_COLUMNS)), axis=1)
+    picked = rng.integers(1, N_COLUMNS + 1, n).astype(float)
+    picked[rng.random(n) < 0.1] = np.nan
+    judgment = np.array(JUDGMENT_SCALE, dtype=object)[rng.integers(0, len(JUDGMENT_SCALE), n)]
+    judgment[np.isnan(picked)] = None
+
+    sessions = {'chat_id': np.arange(n).astype(str), 'timestamp': '2024-11-01 12:00:00',
+                'selected_column': picked, 'judgment': judgment}
+    for i in range(N_COLUMNS):
+        sessions[f'persona_{i + 1}'] = personas[order[:, i]]
+        thumbs = rng.integers(0, 2, n).astype(float)
+        thumbs[rng.random(n) < 0.4] = np.nan
+        sessions[f'thumbs_{i + 1}'] = thumbs
+    return pd.DataFrame(sessions)
+
+
+def benchmark(n_sessions, n_boot=1000):
+    """Times the full report (all tables + order effects) on synthetic sessions."""
+    sessions = synthetic_sessions(n_sessions)
+    start = time.perf_counter()
+    long = to_long(sessions)
+    for by in ['persona', 'position', 'persona_position']:
+        preference_rates(long, by, n_boot)
+    order_effects(long, n_boot)
+    print(f"{n_sessions} sessions, {n_boot} replicates: full report in {time.perf_counter() - start:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-persona and per-position preference rates with bootstrap intervals.')
+    parser.add_argument('root', nargs='?', help='session dataset (export_sessions.py output or the results store)')
+    parser.add_argument('--since', help='first date (YYYY-MM-DD)')
+    parser.add_argument('--until', help='last date (YYYY-MM-DD)')
+    parser.add_argument('--n-boot', type=int, default=1000)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write all rate tables to this CSV')
+    parser.add_argument('--benchmark', type=int, metavar='N_SESSIONS', help='time the report on synthetic sessions instead')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.n_boot)
+        return
+    if not args.root:
+        parser.error('root is required (unless --benchmark is given)')
+
+    sessions = load_sessions(args.root, args.since, args.until)
+    print(f"{len(sessions)} sessions")
+    long = to_long(sessions)
+
+    pd.set_option('display.width', 160)
+    tables = []
+    for by in ['persona', 'position', 'persona_position']:
+        table = preference_rates(long, by, args.n_boot, args.alpha, args.seed)
+        print(f"\n== by {by}\n{table.to_string(index=False, float_format='%.3f')}")
+        tables.append(table.assign(by=by))
+
+    effects = order_effects(long, args.n_boot, args.alpha, args.seed)
+    print(f"\n== order effects (position rate - mean over positions)\n{effects.to_string(index=False, float_format='%.3f')}")
+
+    if args.out:
+        pd.concat(tables).to_csv(args.out, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""
+Model benchmark - offline latency / token / quality comparison of candidate models per stage
+
+Runs the prompts of the flow through each candidate model and reports, per stage:
+- latency (p50 / p95) and tokens per call
+- extraction: agreement of the extracted `what` / `context` / `outcome` / `reaction` slots with a reference
+  (token F1, averaged over slots) -- the reference is either a reference model or the answers stored in the corpus
+- interview: how often the "FINISHED" sentinel is emitted exactly when the recorded interview ended
+- scenario: share of calls returning a parseable `output_scenario`
+
+Inputs are the testing_prompts.py fixtures plus, optionally, a corpus of recorded transcripts
+(a dataset written by export_sessions.py or the local results store).
+
+Candidates are `model`, `model@base_url` (for local OpenAI-compatible servers) or `local:<gguf path>`
+(the in-process CPU backend, see local_llm.py), e.g.:
+    python benchmark_models.py --candidates gpt-4o gpt-4o-mini "llama3.1:8b@http://localhost:11434/v1" \\
+        local:models/qwen2.5-1.5b-instruct-q4_k_m.gguf --corpus exports/sessions --limit 50 --reference gpt-4o
+
+The results are meant to back entries in the [model_routing] secrets section (see llm_clients.py).
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+from langchain_core.prompts import PromptTemplate
+from langchain.output_parsers.json import SimpleJsonOutputParser
+
+from lc_prompts import extraction_prompt, prompt_datacollection_4o, prompt_one_shot, example_set, end_prompt_core
+from lc_scenario_prompts import prompts
+from testing_prompts import test_messages, answer_set as test_answer_set
+from llm_clients import route_chat, STAGE_TEMPERATURES
+from token_accounting import UsageLedger
+
+
+SLOTS = ['what', 'context', 'outcome', 'reaction']
+_TOKEN = re.compile(r'\w+')
+
+
+def parse_candidate(spec):
+    if spec.startswith('local:'):
+        return {'name': spec, 'backend': 'local', 'model': None, 'model_path': spec[len('local:'):], 'base_url': None}
+    model, _, endpoint = spec.partition('@')
+    return {'name': spec, 'backend': 'openai', 'model': model, 'model_path': None, 'base_url': endpoint or None}
+
+
+def token_f1(candidate, reference):
+    """Token-overlap F1 between two answers (1.0 if both are empty / null)."""
+    a = _TOKEN.findall(str(candidate or '').lower())
+    b = _TOKEN.findall(str(reference or '').lower())
+    if not a and not b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    common = sum(min(a.count(t), b.count(t)) for t in set(a))
+    if common == 0:
+        return 0.0
+    precision, recall = common / len(a), common / len(b)
+    return 2 * precision * recall / (precision + recall)
+
+
+def format_history(turns):
+    """Formats (role, content) turns the same way ConversationBufferMemory does."""
+    names = {'human': 'Human', 'ai': 'AI'}
+    return '\n'.join(f"{names.get(role, role)}: {content}" for role, content in turns)
+
+
+def load_corpus(root, limit):
+    """Loads transcripts and their stored answers from an exported dataset."""
+    from results_store import read_sessions
+
+    columns = ['chat_history'] + [f'answer_{slot}' for slot in SLOTS]
+    data = read_sessions(root, columns).to_pylist()
+    corpus = []
+    for row in data[:limit]:
+        turns = [(turn['role'], turn['content']) for turn in row['chat_history'] or []]
+        if len(turns) < 4:
+            continue
+        corpus.append({
+            'turns': turns,
+            'answers': {slot: row[f'answer_{slot}'] for slot in SLOTS},
+        })
+    return corpus
+
+
+def timed_invoke(chain, inputs, ledger, stage):
+    start = time.perf_counter()
+    try:
+        output = chain.invoke(inputs, config={'callbacks': [ledger.callback(stage)]})
+    except Exception as e:
+        output = e
+    return output, time.perf_counter() - start
+
+
+def run_candidate(candidate, transcripts, interviews, answer_sets, api_key):
+    """Runs all stages for one candidate and returns its raw measurements.
+
+    Parameters:
+    candidate (dict): as returned by parse_candidate
+    transcripts (list): formatted conversation histories for the extraction stage
+    interviews (list): recorded interviews as lists of (role, content) turns for the interview stage
+    answer_sets (list): answer dicts for the scenario stage
+    api_key (str): OpenAI API key (ignored by most local servers)
+    """
+    ledger = UsageLedger()
+    json_parser = SimpleJsonOutputParser()
+
+    def chat(stage):
+        route = {**candidate, 'temperature': STAGE_TEMPERATURES[stage], 'api_key': None}
+        return route_chat(route, api_key)
+
+    results = {'extraction': [], 'interview': [], 'scenario': []}
+
+    ## extraction over every transcript
+    extraction_chain = PromptTemplate(input_variables=['conversation_history'], template=extraction_prompt) | chat('extraction') | json_parser
+    for history in transcripts:
+        output, seconds = timed_invoke(extraction_chain, {'conversation_history': history}, ledger, 'extraction')
+        results['extraction'].append({'seconds': seconds, 'output': output if isinstance(output, dict) else None})
+
+    ## interview -- the last human turn should give FINISHED, the one before should not
+    interview_chain = PromptTemplate(input_variables=['history', 'input'], template=prompt_datacollection_4o) | chat('interview')
+    for turns in interviews:
+        human_positions = [i for i, (role, _) in enumerate(turns) if role == 'human']
+        for position, expect_finished in ((human_positions[-2], False), (human_positions[-1], True)) if len(human_positions) >= 2 else ():
+            inputs = {'history': format_history(turns[:position]), 'input': turns[position][1]}
+            output, seconds = timed_invoke(interview_chain, inputs, ledger, 'interview')
+            finished = 'FINISHED' in getattr(output, 'content', '')
+            results['interview'].append({'seconds': seconds, 'correct': finished == expect_finished})
+
+    ## scenarios for every answer set, one per persona
+    scenario_chain = PromptTemplate.from_template(prompt_one_shot) | chat('scenario') | json_parser
+    for answers in answer_sets:
+        for persona_prompt in prompts.values():
+            inputs = {
+                'main_prompt': persona_prompt,
+                'end_prompt': end_prompt_core,
+                **{f'example_{k}': example_set[k] for k in SLOTS + ['scenario']},
+                **{slot: answers.get(slot) or '' for slot in SLOTS},
+            }
+            output, seconds = timed_invoke(scenario_chain, inputs, ledger, 'scenario')
+            results['scenario'].append({'seconds': seconds, 'valid': isinstance(output, dict) and bool(output.get('output_scenario'))})
+
+    results['usage'] = {stage: dict(totals) for stage, totals in ledger.stages.items()}
+    return results
+
+
+def summarise(name, results, references):
+    """Condenses the raw measurements of one candidate into report rows."""
+    rows = []
+    for stage in ['interview', 'extraction', 'scenario']:
+        calls = results[stage]
+        if not calls:
+            continue
+        seconds = np.array([c['seconds'] for c in calls])
+        usage = results['usage'].get(stage, {})
+        row = {
+            'candidate': name,
+            'stage': stage,
+            'calls': len(calls),
+            'p50_s': float(np.percentile(seconds, 50)),
+            'p95_s': float(np.percentile(seconds, 95)),
+            'tokens_per_call': (usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0)) / len(calls),
+        }
+        if stage == 'extraction':
+            scores = [
+                np.mean([token_f1((c['output'] or {}).get(slot), ref.get(slot)) for slot in SLOTS]) if c['output'] else 0.0
+                for c, ref in zip(calls, references) if ref is not None
+            ]
+            row['quality'] = float(np.mean(scores)) if scores else None
+        elif stage == 'interview':
+            row['quality'] = float(np.mean([c['correct'] for c in calls]))
+        else:
+            row['quality'] = float(np.mean([c['valid'] for c in calls]))
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark candidate models on the stages of the study flow.')
+    parser.add_argument('--candidates', nargs='+', required=True, help='model or model@base_url')
+    parser.add_argument('--corpus', help='dataset with recorded transcripts (export_sessions.py output / results store)')
+    parser.add_argument('--limit', type=int, default=50, help='max transcripts taken from the corpus')
+    parser.add_argument('--reference', default='stored', help="'stored' (answers saved with the corpus) or a candidate spec used as reference for extraction")
+    parser.add_argument('--out', help='write the report rows as JSON here')
+    args = parser.parse_args()
+
+    api_key = os.environ.get('OPENAI_API_KEY', 'not-needed-for-local-models')
+
+    ## inputs: the fixtures plus the recorded corpus
+    corpus = load_corpus(args.corpus, args.limit) if args.corpus else []
+    transcripts = [test_messages] + [format_history(t['turns']) for t in corpus]
+    interviews = [t['turns'] for t in corpus]
+    answer_sets = [test_answer_set] + [t['answers'] for t in corpus if any(t['answers'].values())]
+
+    ## reference answers for the extraction agreement
+    if args.reference == 'stored':
+        references = [None] + [t['answers'] for t in corpus]
+    else:
+        reference = parse_candidate(args.reference)
+        reference_results = run_candidate(reference, transcripts, [], [], api_key)
+        references = [c['output'] for c in reference_results['extraction']]
+
+    rows = []
+    for spec in args.candidates:
+        candidate = parse_candidate(spec)
+        print(f'running {spec} ...')
+        results = run_candidate(candidate, transcripts, interviews, answer_sets, api_key)
+        rows += summarise(spec, results, references)
+
+    print(f"\n{'candidate':<40}{'stage':<12}{'calls':>6}{'p50 s':>8}{'p95 s':>8}{'tok/call':>10}{'quality':>9}")
+    for row in rows:
+        quality = '-' if row['quality'] is None else f"{row['quality']:.2f}"
+        print(f"{row['candidate']:<40}{row['stage']:<12}{row['calls']:>6}{row['p50_s']:>8.2f}{row['p95_s']:>8.2f}{row['tokens_per_call']:>10.0f}{quality:>9}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Cancellation - abort in-flight model calls of sessions whose browser has gone away
+
+When a participant closes the tab or reloads, streamlit keeps running the script of the old session until it
+finishes, so every pending chain.invoke would still be completed (and billed), holding worker threads and
+rate-limit capacity for nobody.
+
+CallCanceller.invoke runs a chain with `ainvoke` on a process-wide background event loop and waits for it in
+short slices. Between slices it asks the streamlit runtime whether the session's websocket is still connected;
+if not, the asyncio task is cancelled -- which closes the HTTP request, so the model stops generating -- the
+`on_cancel` hook records the stage, and SessionGone is raised to end the script run.
+
+SessionGone derives from BaseException (like streamlit's own st.stop / st.rerun control flow exceptions), so
+the `except Exception` handlers of the flow don't swallow it.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+
+from streamlit import runtime
+
+
+POLL_INTERVAL = 0.25
+
+_lock = threading.Lock()
+_loop = None
+
+
+class SessionGone(BaseException):
+    """Raised in the script (and worker) threads of a session whose browser disconnected."""
+
+    def __init__(self, stage):
+        super().__init__(f"session disconnected during the {stage} stage")
+        self.stage = stage
+
+
+def get_loop():
+    """The process-wide event loop that runs all cancellable model calls (started on first use)."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='model-calls', daemon=True).start()
+        return _loop
+
+
+def session_connected(session_id):
+    """True while the session's websocket is open (always True outside a streamlit server, e.g. in AppTest or scripts)."""
+    if session_id is None or not runtime.exists():
+        return True
+    return runtime.get_instance().is_active_session(session_id)
+
+
+def submit(coroutine_function, *args, **kwargs):
+    """Runs a coroutine on the background loop in the caller's context (so tracing parents carry over).
+
+    Returns:
+    a concurrent.futures.Future -- cancelling it cancels the asyncio task
+    """
+    loop = get_loop()
+    context = contextvars.copy_context()
+    future = concurrent.futures.Future()
+
+    def start():
+        task = loop.create_task(coroutine_function(*args, **kwargs))
+
+        def done(task):
+            if future.cancelled():
+                return
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+        task.add_done_callback(done)
+        future.add_done_callback(lambda f: f.cancelled() and loop.call_soon_threadsafe(task.cancel))
+
+    # the task copies the context it is created in -- run its creation inside the caller's context
+    loop.call_soon_threadsafe(start, context=context)
+    return future
+
+
+class CallCanceller:
+    """Runs model calls of one session so that they are aborted once the session disconnects.
+
+    Parameters:
+    session_id (str): streamlit session id (get_script_run_ctx().session_id)
+    on_cancel (callable): called as on_cancel(stage) when calls are cancelled
+    """
+
+    def __init__(self, session_id, on_cancel=None):
+        self.session_id = session_id
+        self.on_cancel = on_cancel
+        self.cancelled = threading.Event()
+
+    def invoke(self, runnable, inputs, config=None, stage='unknown'):
+        """Same as runnable.invoke(inputs, config), but aborted (with SessionGone) once the session disconnects."""
+        if self.cancelled.is_set():
+            raise SessionGone(stage)
+        return self._wait(submit(runnable.ainvoke, inputs, config), stage)
+
+    def batch(self, runnable, inputs, config=None, stage='unknown', **kwargs):
+        """Same as runnable.batch(inputs, config, **kwargs) (e.g. return_exceptions), with the same cancellation."""
+        if self.cancelled.is_set():
+            raise SessionGone(stage)
+        return self._wait(submit(runnable.abatch, inputs, config, **kwargs), stage)
+
+    def _wait(self, future, stage):
+        while True:
+            try:
+                return future.result(timeout=POLL_INTERVAL)
+            except concurrent.futures.TimeoutError:
+                if session_connected(self.session_id):
+                    continue
+            future.cancel()
+            self._cancel(stage)
+            raise SessionGone(stage)
+
+    def _cancel(self, stage):
+        # several concurrent calls of the session notice the disconnect -- the hook runs once
+        with _lock:
+            first = not self.cancelled.is_set()
+            self.cancelled.set()
+        if first and self.on_cancel is not None:
+            self.on_cancel(stage)
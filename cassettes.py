@@ -0,0 +1,207 @@
+"""
+Cassettes - record / replay of model calls at the HTTP layer
+
+A CassetteTransport sits under the shared httpx client (see llm_clients.py), so it sees every model request
+the app makes. Each request is keyed by a hash of its normalised content (method, path and JSON body with
+sorted keys), and the response is stored in a JSONL cassette together with the latency it had.
+
+Modes (LLM_CASSETTE_MODE secret / environment variable, cassette path in LLM_CASSETTE):
+- record : every call goes to the real endpoint and is appended to the cassette
+- replay : calls are answered from the cassette only -- no network, zero latency; unknown requests get a 404
+- auto   : replay when the request is in the cassette, otherwise call the endpoint and record it
+
+Set LLM_CASSETTE_REPLAY_LATENCY=true to sleep for the recorded latency on replay (for benchmarking with production latencies).
+
+Only successful (2xx) responses are recorded -- rate limits, auth failures and server errors are passed through
+but never replayed. The sync and async transports of a cassette file share one in-memory store (get_store), so
+entries recorded by one are replayed by the other.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+
+MODES = ('record', 'replay', 'auto')
+
+_stores_lock = threading.Lock()
+_stores = {}
+
+
+def normalise_body(content):
+    """JSON bodies are re-serialised with sorted keys and trimmed message text, so formatting noise does not change the key."""
+    if not content:
+        return ''
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return content.decode('utf-8', errors='replace')
+    for message in body.get('messages', []) if isinstance(body, dict) else []:
+        if isinstance(message.get('content'), str):
+            message['content'] = message['content'].strip()
+    return json.dumps(body, sort_keys=True, ensure_ascii=False)
+
+
+def request_key(request):
+    """Hash of the normalised request -- host, headers (API keys!) and query order are deliberately left out."""
+    normalised = '\n'.join([request.method, urlsplit(str(request.url)).path, normalise_body(request.content)])
+    return hashlib.sha256(normalised.encode('utf-8')).hexdigest()
+
+
+class CassetteStore:
+    """The entries of one cassette file, shared by all transports using it (thread-safe)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry['key']] = entry
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def add(self, entry):
+        with self.lock:
+            self.entries[entry['key']] = entry
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def get_store(path):
+    """The process-wide store of a cassette file (created on first use)."""
+    with _stores_lock:
+        key = os.path.abspath(path)
+        if key not in _stores:
+            _stores[key] = CassetteStore(path)
+        return _stores[key]
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """httpx transport that records responses to / replays them from a JSONL cassette.
+
+    Parameters:
+    path (str): cassette file
+    mode (str): 'record', 'replay' or 'auto'
+    replay_latency (bool): sleep for the recorded latency when replaying
+    transport (httpx.BaseTransport): the real transport used for recording
+    """
+
+    def __init__(self, path, mode='auto', replay_latency=False, transport=None):
+        if mode not in MODES:
+            raise ValueError(f"cassette mode must be one of {MODES}, not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.transport = transport or httpx.HTTPTransport()
+        self.store = get_store(path)
+
+    def handle_request(self, request):
+        request.read()
+        key = request_key(request)
+
+        response = self._replay(request, key)
+        if response is not None:
+            if self.replay_latency:
+                time.sleep(response.extensions['cassette_latency'])
+            return response
+
+        start = time.perf_counter()
+        response = self.transport.handle_request(request)
+        response.read()
+        return self._record(request, key, response, time.perf_counter() - start)
+
+    def _replay(self, request, key):
+        """The recorded response (or a 404 in replay mode) -- None if the request has to go to the endpoint."""
+        entry = self.store.get(key) if self.mode != 'record' else None
+        if entry is not None:
+            return httpx.Response(
+                entry['status'],
+                headers={'content-type': entry.get('content_type', 'application/json')},
+                content=entry['body'].encode('utf-8'),
+                request=request,
+                extensions={'cassette_latency': entry.get('latency', 0)},
+            )
+
+        if self.mode == 'replay':
+            # a 4xx is raised straight away by the openai client (connection errors would be retried)
+            return httpx.Response(
+                404,
+                json={'error': {'message': f'no cassette entry for request {key} in {self.path}', 'type': 'cassette_miss'}},
+                request=request,
+                extensions={'cassette_latency': 0},
+            )
+        return None
+
+    def _record(self, request, key, response, latency):
+        # errors (429 rate limits, 401/403, 5xx ...) are not completions -- never replay them
+        if response.is_success:
+            self.store.add({
+                'key': key,
+                'method': request.method,
+                'path': urlsplit(str(request.url)).path,
+                'status': response.status_code,
+                'content_type': response.headers.get('content-type', 'application/json'),
+                'body': response.text,
+                'latency': round(latency, 4),
+            })
+
+        # the body was consumed (and decoded) above, so hand back a fresh response with the same content
+        headers = [(k, v) for k, v in response.headers.items() if k.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')]
+        return httpx.Response(response.status_code, headers=headers, content=response.content, request=request)
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncCassetteTransport(CassetteTransport, httpx.AsyncBaseTransport):
+    """The same cassette for async clients (used by the cancellable ainvoke calls, see cancellation.py).
+
+    transport (httpx.AsyncBaseTransport): the real async transport used for recording
+    """
+
+    def __init__(self, path, mode='auto', replay_latency=False, transport=None):
+        super().__init__(path, mode, replay_latency, transport or httpx.AsyncHTTPTransport())
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        key = request_key(request)
+
+        response = self._replay(request, key)
+        if response is not None:
+            if self.replay_latency:
+                await asyncio.sleep(response.extensions['cassette_latency'])
+            return response
+
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        await response.aread()
+        return self._record(request, key, response, time.perf_counter() - start)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def transport_from_env(transport):
+    """Wraps the real transport in a cassette if LLM_CASSETTE is set, otherwise returns it unchanged."""
+    path = os.environ.get('LLM_CASSETTE')
+    if not path:
+        return transport
+    cassette_class = AsyncCassetteTransport if isinstance(transport, httpx.AsyncBaseTransport) else CassetteTransport
+    return cassette_class(
+        path,
+        mode=os.environ.get('LLM_CASSETTE_MODE', 'auto'),
+        replay_latency=os.environ.get('LLM_CASSETTE_REPLAY_LATENCY', '').lower() in ('1', 'true', 'yes'),
+        transport=transport,
+    )
@@ -0,0 +1,143 @@
+"""
+Example library - nearest-neighbour selection of the one-shot example for the scenario prompt
+
+prompt_one_shot shows the model one worked example (answers -> scenario). Instead of always using the global
+example_set from lc_prompts.py, summariseData picks the library example whose answers are closest to the
+participant's extracted answer_set, and the chosen id is stored in the package ('example_id').
+
+The index is a TF-IDF matrix over hashed word unigrams and bigrams (N_FEATURES columns), built once per process
+with NumPy. A query hashes the answer_set into a handful of (column, weight) pairs and scores all examples with a
+single gather + dot product -- well under a millisecond for thousands of examples.
+
+The library is the two examples from lc_prompts.py plus an optional JSONL file (`example_library_file` secret),
+one example per line with `id`, `what`, `context`, `outcome`, `reaction` and `scenario`. A file can be built from
+sessions whose first scenario was accepted as is (no adaptation rounds needed):
+    python example_library.py exports/sessions --out examples.jsonl --limit 500
+"""
+
+import argparse
+import json
+import re
+import zlib
+
+import numpy as np
+
+from lc_prompts import example_set, example_set1
+
+
+SLOTS = ['what', 'context', 'outcome', 'reaction']
+
+N_FEATURES = 2**12
+
+# below this cosine similarity the default example is used
+MIN_SIMILARITY = 0.05
+
+DEFAULT_EXAMPLES = [
+    {'id': 'default', **example_set},
+    {'id': 'peer_pressure', **example_set1},
+]
+
+_TOKEN = re.compile(r"[a-z']+")
+
+
+def hashed_terms(text, n_features=N_FEATURES):
+    """Column indices of the hashed unigrams and bigrams of a text (with repeats)."""
+    words = _TOKEN.findall(str(text).lower())
+    terms = words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+    return np.array([zlib.crc32(term.encode('utf-8')) % n_features for term in terms], dtype=np.int64)
+
+
+def answers_text(answers):
+    if isinstance(answers, dict):
+        return ' '.join(str(answers.get(slot) or '') for slot in SLOTS)
+    return str(answers or '')
+
+
+class ExampleLibrary:
+    """Hashed TF-IDF index over the answers of the library examples.
+
+    Parameters:
+    examples (list): example dicts with `id`, the four answer slots and `scenario` -- the first one is the default
+    n_features (int): number of hash buckets
+    """
+
+    def __init__(self, examples, n_features=N_FEATURES):
+        self.examples = list(examples)
+        self.n_features = n_features
+        self.default = self.examples[0]
+
+        ## term counts -> document frequencies -> idf-weighted, L2-normalised rows
+        counts = np.zeros((len(self.examples), n_features), dtype=np.float32)
+        for i, example in enumerate(self.examples):
+            np.add.at(counts[i], hashed_terms(answers_text(example), n_features), 1.0)
+        document_frequency = (counts > 0).sum(axis=0)
+        self.idf = (np.log((1 + len(self.examples)) / (1 + document_frequency)) + 1).astype(np.float32)
+        weights = np.log1p(counts) * self.idf
+        norms = np.linalg.norm(weights, axis=1, keepdims=True)
+        self.matrix = weights / np.where(norms == 0, 1, norms)
+
+    @classmethod
+    def from_file(cls, path=None):
+        """The default examples plus the ones in a JSONL file (if given)."""
+        examples = list(DEFAULT_EXAMPLES)
+        if path:
+            with open(path) as f:
+                examples += [json.loads(line) for line in f if line.strip()]
+        return cls(examples)
+
+    def nearest(self, answers, min_similarity=MIN_SIMILARITY):
+        """Returns (example, cosine similarity) of the closest example -- the default one if nothing is close enough."""
+        columns, term_counts = np.unique(hashed_terms(answers_text(answers), self.n_features), return_counts=True)
+        if len(columns) == 0:
+            return self.default, 0.0
+        query = np.log1p(term_counts.astype(np.float32)) * self.idf[columns]
+        query /= np.linalg.norm(query)
+
+        # only the query's columns matter -- a (n_examples x n_terms) gather instead of a full matrix product
+        similarities = self.matrix[:, columns] @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < min_similarity:
+            return self.default, float(similarities[best])
+        return self.examples[best], float(similarities[best])
+
+
+def build_from_sessions(root, limit):
+    """Turns sessions whose first pick was accepted without adaptation into library examples."""
+    from results_store import read_sessions
+
+    columns = ['chat_id', 'timestamp', 'judgment', 'n_adaptations', 'final_scenario'] + [f'answer_{slot}' for slot in SLOTS]
+    examples = []
+    seen = set()
+    for row in read_sessions(root, columns).to_pylist():
+        key = (row['chat_id'], row['timestamp'])
+        if key in seen or row['judgment'] != "Ready as is!" or row['n_adaptations'] or not row['final_scenario']:
+            continue
+        if not all(row[f'answer_{slot}'] for slot in SLOTS):
+            continue
+        seen.add(key)
+        examples.append({
+            'id': f"{row['chat_id']}|{row['timestamp']}",
+            **{slot: row[f'answer_{slot}'] for slot in SLOTS},
+            'scenario': row['final_scenario'],
+        })
+        if len(examples) >= limit:
+            break
+    return examples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build an example library file from sessions accepted without adaptation.')
+    parser.add_argument('root', help='session dataset (export_sessions.py output or the results store)')
+    parser.add_argument('--out', required=True, help='JSONL file to write')
+    parser.add_argument('--limit', type=int, default=500)
+    args = parser.parse_args()
+
+    examples = build_from_sessions(args.root, args.limit)
+    with open(args.out, 'w') as f:
+        for example in examples:
+            f.write(json.dumps(example, ensure_ascii=False) + '\n')
+    print(f"{len(examples)} examples written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
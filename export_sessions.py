@@ -0,0 +1,195 @@
+"""
+Session export - parallel segmented scan of the study table into partitioned Parquet
+
+Runs a DynamoDB parallel scan (one worker per segment) over the session table, flattens each
+stored scenario package (see session_records.py) and streams the rows into a date-partitioned
+Parquet dataset (`<out_dir>/date=YYYY-MM-DD/part-<run>-<segment>.parquet`).
+
+Incremental exports: the highest `timestamp` seen is stored in a small state file next to the dataset,
+and the next run only scans for newer sessions. As items are written when a session is finalised
+(but keyed on the timestamp of the session start), `--lookback-minutes` re-exports a window before the
+watermark so slow sessions are not missed -- rows are then deduplicated on (chat_id, timestamp) when reading.
+
+Usage:
+    python export_sessions.py --out exports/sessions --segments 8
+    python export_sessions.py --out exports/sessions --incremental
+    python export_sessions.py --out exports/sessions --endpoint-url http://localhost:8000   # DynamoDB Local / moto
+
+Credentials are taken from the usual boto3 chain (environment variables, ~/.aws, ...).
+"""
+
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+import pyarrow.parquet as pq
+
+from session_records import SESSION_SCHEMA, flatten_package, rows_to_table
+
+
+DEFAULT_TABLE = 'petr_micronarrative_nov2024'
+STATE_FILE = '_export_state.json'
+
+
+def load_watermark(out_dir):
+    """Returns the last exported timestamp (or None for a full export)."""
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get('last_timestamp')
+
+
+def save_watermark(out_dir, last_timestamp, n_rows):
+    """Stores the new high watermark -- only called once every segment finished successfully."""
+    path = os.path.join(out_dir, STATE_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            'last_timestamp': last_timestamp,
+            'rows_exported': n_rows,
+            'exported_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }, f)
+    os.replace(tmp_path, path)
+
+
+class PartitionedWriter:
+    """Streams tables for one scan segment into one Parquet file per date partition.
+
+    Each segment owns its own writers, so no locking is needed between workers.
+    """
+
+    def __init__(self, out_dir, run_tag, segment):
+        self.out_dir = out_dir
+        self.run_tag = run_tag
+        self.segment = segment
+        self.writers = {}
+        self.file_schema = SESSION_SCHEMA.remove(SESSION_SCHEMA.get_field_index('date'))
+
+    def write_rows(self, rows):
+        """Groups the rows by date and appends them as a row group to the matching partition file."""
+        by_date = {}
+        for row in rows:
+            by_date.setdefault(row['date'], []).append(row)
+
+        for date, date_rows in by_date.items():
+            # the date is encoded in the (hive-style) directory name, not stored in the file
+            table = rows_to_table(date_rows).drop_columns(['date'])
+            if date not in self.writers:
+                part_dir = os.path.join(self.out_dir, f'date={date}')
+                os.makedirs(part_dir, exist_ok=True)
+                path = os.path.join(part_dir, f'part-{self.run_tag}-{self.segment:03d}.parquet')
+                self.writers[date] = pq.ParquetWriter(path, self.file_schema, compression='zstd')
+            self.writers[date].write_table(table)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+def scan_segment(segment, total_segments, args, since, run_tag, progress):
+    """Scans one segment of the table page by page and streams each page to Parquet.
+
+    Returns:
+    (number of rows written, max timestamp seen in this segment)
+    """
+    # boto3 resources are not thread safe -- every worker gets its own session
+    session = boto3.session.Session()
+    table = session.resource('dynamodb', endpoint_url=args.endpoint_url, region_name=args.region).Table(args.table)
+
+    scan_kwargs = {
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        'Limit': args.page_size,
+    }
+    if since is not None:
+        scan_kwargs['FilterExpression'] = Attr('timestamp').gt(since)
+
+    writer = PartitionedWriter(args.out, run_tag, segment)
+    n_rows = 0
+    max_ts = None
+
+    try:
+        while True:
+            page = table.scan(**scan_kwargs)
+            rows = [flatten_package(item) for item in page.get('Items', [])]
+            if rows:
+                writer.write_rows(rows)
+                n_rows += len(rows)
+                page_max = max(row['timestamp'] or '' for row in rows)
+                if max_ts is None or page_max > max_ts:
+                    max_ts = page_max
+                progress(len(rows))
+
+            if 'LastEvaluatedKey' not in page:
+                break
+            scan_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+    finally:
+        writer.close()
+
+    return n_rows, max_ts
+
+
+def export_sessions(args):
+    """Runs the (optionally incremental) parallel export and returns the number of exported rows."""
+    os.makedirs(args.out, exist_ok=True)
+
+    since = None
+    if args.incremental:
+        since = load_watermark(args.out)
+        if since is not None and args.lookback_minutes:
+            since = (datetime.strptime(since, "%Y-%m-%d %H:%M:%S") - timedelta(minutes=args.lookback_minutes)).strftime("%Y-%m-%d %H:%M:%S")
+
+    run_tag = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    ## simple shared progress counter for the console
+    lock = threading.Lock()
+    done = [0]
+
+    def progress(n):
+        with lock:
+            done[0] += n
+            print(f'\rexported {done[0]} sessions', end='', flush=True)
+
+    with ThreadPoolExecutor(max_workers=args.segments) as pool:
+        futures = [
+            pool.submit(scan_segment, segment, args.segments, args, since, run_tag, progress)
+            for segment in range(args.segments)
+        ]
+        # .result() re-raises a failed segment -- in that case the watermark is not moved
+        results = [future.result() for future in futures]
+    print()
+
+    n_rows = sum(n for n, _ in results)
+    timestamps = [ts for _, ts in results if ts]
+    previous = load_watermark(args.out)
+    if timestamps:
+        new_watermark = max(timestamps + ([previous] if previous else []))
+        save_watermark(args.out, new_watermark, n_rows)
+
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export study sessions from DynamoDB into partitioned Parquet.')
+    parser.add_argument('--table', default=DEFAULT_TABLE, help='DynamoDB table name')
+    parser.add_argument('--out', default='exports/sessions', help='output directory of the Parquet dataset')
+    parser.add_argument('--segments', type=int, default=8, help='number of parallel scan segments / worker threads')
+    parser.add_argument('--page-size', type=int, default=500, help='items requested per scan page')
+    parser.add_argument('--incremental', action='store_true', help='only export sessions newer than the last run')
+    parser.add_argument('--lookback-minutes', type=int, default=120, help='re-export window before the watermark in incremental mode')
+    parser.add_argument('--endpoint-url', default=os.environ.get('DYNAMODB_ENDPOINT_URL'), help='e.g. http://localhost:8000 for DynamoDB Local')
+    parser.add_argument('--region', default=os.environ.get('AWS_DEFAULT_REGION', 'eu-west-2'))
+    args = parser.parse_args()
+
+    n_rows = export_sessions(args)
+    print(f'done -- {n_rows} sessions written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -16,11 +16,10 @@ from langchain_community.chat_message_histories import StreamlitChatMessageHisto
 from langchain.memory import ConversationBufferMemory
 from langchain_core.prompts import PromptTemplate
 from langchain.chains import ConversationChain
-from langchain_openai import ChatOpenAI
 from langchain.output_parsers.json import SimpleJsonOutputParser
-from langsmith import Client
 from langsmith import traceable
-from langsmith.run_helpers import get_current_run_tree
+from langsmith.run_helpers import get_current_run_tree, tracing_context
+from langchain_core.tracers.context import tracing_v2_enabled
 
 # === Streamlit Feedback Integration ===
 from streamlit_feedback import streamlit_feedback
@@ -31,6 +30,8 @@ from botocore.exceptions import ClientError
 
 # === Python Standard Library ===
 import random
+import threading
+import uuid
 from datetime import datetime
 from functools import partial
 import os
@@ -43,6 +44,23 @@ import streamlit as st
 from lc_prompts import *
 from lc_scenario_prompts import *
 from testing_prompts import * 
+from results_store import ResultsStore
+from persona_stats import PersonaStats
+from near_duplicates import make_indexes, index_dataset, check_package
+from token_accounting import UsageLedger, Budget, process_ledger
+from llm_clients import route_chat, stage_route, warm_up
+from admission import AdmissionController
+from slot_extraction import extract_slots
+from slot_interview import SlotInterviewer, empty_slots
+from trace_spool import SpoolingClient
+from pii_redaction import Redactor, load_names, PACKAGE_TEXT_FIELDS
+from pid_index import CompletedParticipants
+from scenario_ranking import ScenarioScorer, generate_ranked, log_to_item
+from example_library import ExampleLibrary
+from profiler import RerunProfiler
+from cancellation import CallCanceller, SessionGone
+from stage_cache import StageCache
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 
 
@@ -50,28 +68,133 @@ from testing_prompts import *
 os.environ["OPENAI_API_KEY"] = st.secrets['OPENAI_API_KEY']
 os.environ["LANGCHAIN_API_KEY"] = st.secrets['LANGCHAIN_API_KEY']
 os.environ["LANGCHAIN_PROJECT"] = st.secrets['LANGCHAIN_PROJECT']
-os.environ["LANGCHAIN_TRACING_V2"] = 'true'
+# tracing can be switched off (or sampled, see trace_spool.py) in the [tracing] secrets section
+tracing_config = st.secrets.get('tracing', {})
+TRACING = bool(tracing_config.get('enabled', True))
+os.environ["LANGCHAIN_TRACING_V2"] = 'true' if TRACING else 'false'
 os.environ["AWS_ACCESS_KEY_ID"] = st.secrets['AWS_ACCESS_KEY_ID']
 os.environ["AWS_SECRET_ACCESS_KEY"] = st.secrets['AWS_SECRET_ACCESS_KEY']
 os.environ["AWS_DEFAULT_REGION"] = st.secrets['AWS_DEFAULT_REGION']
+# optional -- e.g. a local OpenAI-compatible mock server for testing
+if 'openai_base_url' in st.secrets:
+    os.environ["OPENAI_BASE_URL"] = st.secrets['openai_base_url']
+# optional -- record / replay model calls from a cassette for fast, deterministic development & CI runs (see cassettes.py)
+for cassette_setting in ['LLM_CASSETTE', 'LLM_CASSETTE_MODE', 'LLM_CASSETTE_REPLAY_LATENCY']:
+    if cassette_setting in st.secrets:
+        os.environ[cassette_setting] = str(st.secrets[cassette_setting])
+
+# must be the first streamlit command -- before any of the cached resources below (their spinners count as commands)
+st.set_page_config(page_title="Study bot", page_icon="📖")
+st.title("📖 Study bot")
 
 # Initialize table
 dynamodb = boto3.resource(
     'dynamodb',
     aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
     aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
-    region_name=os.environ["AWS_DEFAULT_REGION"]
+    region_name=os.environ["AWS_DEFAULT_REGION"],
+    # optional -- DynamoDB Local / the load-test mock server
+    endpoint_url=st.secrets.get('DYNAMODB_ENDPOINT_URL')
 )
 table = dynamodb.Table('petr_micronarrative_nov2024')
 
+@st.cache_resource
+def get_results_store():
+    """Local append-only Parquet copy of every completed session (see results_store.py) -- one writer per process."""
+    return ResultsStore(st.secrets.get('RESULTS_STORE_DIR', 'results_store'))
+
+results_store = get_results_store()
+
+@st.cache_resource
+def get_persona_stats():
+    """In-process per-persona counters for live monitoring (see persona_stats.py and monitor_app.py)."""
+    return PersonaStats(st.secrets.get('PERSONA_STATS_DIR', 'persona_stats'), instance=st.secrets.get('PERSONA_STATS_INSTANCE'))
+
+persona_stats = get_persona_stats()
+
+@st.cache_resource
+def get_duplicate_indexes():
+    """MinHash/LSH indexes of answers and scenarios (see near_duplicates.py), seeded in the background from the local results store."""
+    indexes = make_indexes()
+    store_dir = st.secrets.get('RESULTS_STORE_DIR', 'results_store')
+
+    def seed():
+        try:
+            for _ in index_dataset(indexes, store_dir):
+                pass
+        except Exception as e:
+            print(f"could not seed the duplicate index from {store_dir}: {e}")
+
+    threading.Thread(target=seed, name='duplicate-index-seed', daemon=True).start()
+    return indexes
+
+duplicate_indexes = get_duplicate_indexes()
+
+@st.cache_resource
+def get_redactor():
+    """Precompiled PII matcher (see pii_redaction.py), with an optional name gazetteer from the `pii_names_file` secret."""
+    names_file = st.secrets.get('pii_names_file')
+    return Redactor(load_names(names_file) if names_file else ())
+
+redactor = get_redactor()
+
+@st.cache_resource
+def get_completed_participants():
+    """Bloom-filter index of pids that already completed the study (see pid_index.py), loaded from the table in the background."""
+    def make_table():
+        # a separate boto3 session per thread -- resources are not thread safe
+        return boto3.session.Session().resource(
+            'dynamodb',
+            aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
+            aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
+            region_name=os.environ["AWS_DEFAULT_REGION"],
+            endpoint_url=st.secrets.get('DYNAMODB_ENDPOINT_URL')
+        ).Table(table.name)
+
+    config = st.secrets.get('participant_index', {})
+    index = CompletedParticipants(make_table, **{k: v for k, v in dict(config).items() if k in ('capacity', 'error_rate')})
+    return index.load_async()
+
+completed_participants = get_completed_participants()
+
+@st.cache_resource
+def get_example_library():
+    """One-shot examples for the scenario prompt with their hashed TF-IDF index (see example_library.py)."""
+    return ExampleLibrary.from_file(st.secrets.get('example_library_file'))
+
+example_library = get_example_library()
+
+@st.cache_resource
+def get_stage_cache():
+    """Results of completed stages per participant, so a reloaded session can resume (see stage_cache.py)."""
+    config = st.secrets.get('stage_cache', {})
+    return StageCache(**{k: v for k, v in dict(config).items() if k in ('ttl_seconds', 'max_participants')})
+
+stage_cache = get_stage_cache()
+
+@st.cache_resource
+def get_rerun_profiler():
+    """Opt-in per-rerun profiler (see profiler.py) -- only used with ?profile=1 or the PROFILE_RERUNS environment variable."""
+    config = st.secrets.get('profiling', {})
+    return RerunProfiler(**{k: v for k, v in dict(config).items() if k in ('out_dir', 'interval', 'max_profiles', 'top_allocations')})
+
+@st.cache_resource
+def get_admission_controller():
+    """Process-wide limit on active interviews with a FIFO waiting room (see admission.py and the [admission] secrets section)."""
+    return AdmissionController.from_config(st.secrets.get('admission', {}))
+
+admission = get_admission_controller()
+
 ## simple switch previously used to help debug 
 DEBUG = False
 
 # Langsmith set-up 
-smith_client = Client()
+@st.cache_resource
+def get_smith_client():
+    """Process-wide LangSmith client -- uploads are sampled and buffered on a background thread (see trace_spool.py)."""
+    return SpoolingClient.from_config(tracing_config)
 
-st.set_page_config(page_title="Study bot", page_icon="📖")
-st.title("📖 Study bot")
+smith_client = get_smith_client()
 
 def make_chat_id():
     ts = datetime.now().strftime("%Y%m%d%H%M%S")
@@ -82,15 +205,55 @@ def make_chat_id():
     chat_id = f'{prolific_id}'
     return chat_id
 
+def restoreSession(cached):
+    """Picks up the stage results of an earlier session of the same participant that was reloaded / disconnected (see stage_cache.py).
+
+    cached (dict): as returned by stage_cache.restore
+    """
+    stages = cached['stages']
+    if 'interview' in stages:
+        # the key used by StreamlitChatMessageHistory below
+        st.session_state['langchain_messages'] = list(stages['interview'])
+    if 'slots' in stages:
+        st.session_state['interview_slots'] = dict(stages['slots'])
+    if 'extraction' in stages:
+        st.session_state['answer_set'] = stages['extraction']
+    if 'scenarios' in stages:
+        for key, value in stages['scenarios'].items():
+            st.session_state[key] = value
+        # straight back to the review page -- no need to generate the scenarios again
+        st.session_state['agentState'] = 'review'
+    elif 'extraction' in stages or stages.get('interview_complete'):
+        # the interview was over -- summariseData continues from the cached answers (or extracts them from the restored transcript)
+        st.session_state['agentState'] = 'summarise'
+    st.session_state['cancelled_stages'] = cached['cancelled']
+
 if "chat_id" not in st.session_state:
     st.session_state["chat_id"] = make_chat_id()
     st.session_state["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # unique per browser session (the pid alone is not) -- used for the admission queue
+    st.session_state["admission_key"] = f'{st.session_state["chat_id"]}-{uuid.uuid4().hex[:8]}'
+
+    # the stage cache is keyed by the pid *and* a random token kept in this tab's URL -- a reload resumes,
+    # another browser opening the app with the same pid does not get this participant's transcript
+    if 'resume' not in st.query_params:
+        st.query_params['resume'] = uuid.uuid4().hex
+    st.session_state["resume_key"] = (st.session_state["chat_id"], st.query_params['resume'])
+
+    cached = stage_cache.restore(st.session_state["resume_key"])
+    if cached is not None:
+        restoreSession(cached)
     
 init_state = {
     "run_id": None,
     "agentState": "start",
     "consent": False,
+    "admitted": False,
+    # set once the session gave its slot back at finalise -- it is not renewed / re-queued from then on
+    "released": False,
     "exp_data": True,
+    "pii_counts": {},
+    "interview_slots": empty_slots(),
     "llm_model": "gpt-4o"#,
     # "col1_fb": {"score": "", "text": ""},
     # "col2_fb": {"score": "", "text": ""},
@@ -102,6 +265,26 @@ for key, value in init_state.items():
     if key not in st.session_state:
         st.session_state[key] = value
 
+# model calls of summarise / adaptation are aborted when this session's browser disconnects (see cancellation.py)
+def cancelSession(stage, chat_id = st.session_state['chat_id'], resume_key = st.session_state['resume_key'], admission_key = st.session_state['admission_key']):
+    # called from worker threads -- only uses values bound now, not st.session_state
+    print(f"session {chat_id} disconnected during the {stage} stage -- model calls cancelled")
+    stage_cache.record_cancel(resume_key, stage)
+    admission.release(admission_key)
+
+canceller = CallCanceller(get_script_run_ctx().session_id, on_cancel = cancelSession)
+
+# per-session token & cost accounting (see token_accounting.py) -- every model call books onto this ledger
+if "usage_ledger" not in st.session_state:
+    st.session_state["usage_ledger"] = UsageLedger(parent=process_ledger)
+usage_ledger = st.session_state["usage_ledger"]
+budget = Budget.from_config(st.secrets.get('budget', {}))
+
+# optional per-stage model routing (see llm_clients.py) -- stages without an entry use st.session_state.llm_model
+model_routing = st.secrets.get('model_routing', {})
+
+# 'chat': free-text interview ending in "FINISHED" + extraction pass; 'slots': structured turns that fill the answers as they go (see slot_interview.py)
+interview_mode = st.secrets.get('interview_mode', 'chat')
     
 
 # Set up memory for the lanchchain conversation bot
@@ -119,7 +302,7 @@ if st.session_state['llm_model'] == "gpt-4o":
 def getData (testing = False ): 
     """Collects answers to main questions from the user. 
     
-    The conversation flow is stored in the msgs variable (which acts as the persistent langchain-streamlit memory for the bot). The prompt for LLM must be set up to return "FINISHED" when all data is collected. 
+    The conversation flow is stored in the msgs variable (which acts as the persistent langchain-streamlit memory for the bot). In 'chat' interview mode, the prompt for LLM must be set up to return "FINISHED" when all data is collected; in 'slots' mode every turn returns the answers it picked up (kept in st.session_state['interview_slots']) and whether the interview is complete. 
     
     Parameters: 
     testing: bool variable that will insert a dummy conversation instead of engaging with the user
@@ -149,29 +332,48 @@ def getData (testing = False ):
 
     # If user inputs a new answer to the chatbot, generate a new response and add into msgs
     if prompt:
+        # scrub identifying details before the turn reaches the model / memory (see pii_redaction.py)
+        # (a new local -- assigning to `prompt` would make it local to getData and hide the chat input)
+        human_text, found = redactor.redact(prompt)
+        for kind, n in found.items():
+            st.session_state['pii_counts'][kind] = st.session_state['pii_counts'].get(kind, 0) + n
+
         # Note: new messages are saved to history automatically by Langchain during run 
         with entry_messages:
             # show that the message was accepted 
-            st.chat_message("human").write(prompt)
-            msg = {"role": "human", "content": prompt}
+            st.chat_message("human").write(human_text)
+            msg = {"role": "human", "content": human_text}
             # append_list_entry(st.session_state["chat_id"], "interview_chat", msg)
             
             
             # generate the reply using langchain 
-            response = conversation.invoke(input = prompt)
+            config = {"callbacks": [usage_ledger.callback('interview')]}
+            if interview_mode == 'slots':
+                # the reply plus the answers given so far -- the interview ends with the answer_set already built
+                turn = interviewer.turn(msgs, human_text, st.session_state['interview_slots'], config = config)
+                st.session_state['interview_slots'] = turn['slots']
+                stage_cache.put(st.session_state['resume_key'], 'slots', turn['slots'])
+                reply, finished = turn['reply'], turn['complete']
+            else:
+                response = conversation.invoke(input = human_text, config = config)
+                # the prompt must be set up to return "FINISHED" once all questions have been answered
+                reply, finished = response['response'], "FINISHED" in response['response']
+            # keep the transcript so a reload can continue the interview
+            stage_cache.put(st.session_state['resume_key'], 'interview', list(msgs.messages))
             
-            # the prompt must be set up to return "FINISHED" once all questions have been answered
             # If finished, move the flow to summarisation, otherwise continue.
-            if "FINISHED" in response['response']:
+            if finished:
+                # a reload from here on continues with the summarisation, not with the interview
+                stage_cache.put(st.session_state['resume_key'], 'interview_complete', True)
                 st.divider()
                 st.chat_message("ai").write("Thank you for sharing your experience with us.")
 
-                # call the summarisation  agent
+                # call the summarisation  agent (which continues straight into the review)
                 st.session_state.agentState = "summarise"
-                summariseData(testing)
+                summariseAndReview(testing)
             else:
-                st.chat_message("ai").write(response["response"])
-                msg = {"role": "assistant", "content": response["response"]}
+                st.chat_message("ai").write(reply)
+                msg = {"role": "assistant", "content": reply}
                 # append_list_entry(st.session_state["chat_id"], "interview_chat", msg)
 
  
@@ -188,8 +390,13 @@ def extractChoices(msgs, testing ):
 
     """
 
-    ## set up our extraction LLM -- low temperature for repeatable results
-    extraction_llm = ChatOpenAI(temperature=0.1, model=st.session_state.llm_model, openai_api_key=openai_api_key)
+    ## set up our extraction LLM -- low temperature for repeatable results (see STAGE_TEMPERATURES in llm_clients.py)
+    extraction_llm = stageChat('extraction')
+    config = {"callbacks": [usage_ledger.callback('extraction')]}
+
+    ## 'per_slot' mode: four small concurrent calls on the relevant part of the transcript (see slot_extraction.py)
+    if st.secrets.get('extraction_mode', 'single') == 'per_slot':
+        return extract_slots(extraction_llm, test_messages if testing else msgs, config = config, canceller = canceller)
 
     ## taking the prompt from lc_prompts.py file
     extraction_template = PromptTemplate(input_variables=["conversation_history"], template = extraction_prompt)
@@ -201,9 +408,9 @@ def extractChoices(msgs, testing ):
     
     # allow for testing the flow with pre-generated messages -- see testing_prompts.py
     if testing:
-        extractedChoices = extractionChain.invoke({"conversation_history" : test_messages})
+        extractedChoices = canceller.invoke(extractionChain, {"conversation_history" : test_messages}, config = config, stage = 'extraction')
     else: 
-        extractedChoices = extractionChain.invoke({"conversation_history" : msgs})
+        extractedChoices = canceller.invoke(extractionChain, {"conversation_history" : msgs}, config = config, stage = 'extraction')
     
 
     return(extractedChoices)
@@ -247,6 +454,12 @@ def collectFeedback(answer, column_id,  scenario):
 
 
     if score is not None:
+        ## update the live persona counters -- column_id is 'col1'..'col3'
+        position = int(column_id[-1])
+        persona_order = st.session_state.get('persona_order')
+        if persona_order:
+            persona_stats.record_thumbs(persona_order[position - 1], position, score)
+
         # Formulate feedback type string incorporating the feedback option
         # and score value
         feedback_type_str = f"{answer['type']} {score} {answer['text']} \n {scenario}"
@@ -259,20 +472,21 @@ def collectFeedback(answer, column_id,  scenario):
         payload = f"{answer['score']} rating scenario: \n {scenario} \n Based on: \n {answer_set}"
 
         # Record the feedback with the formulated feedback type string
-        # and optional comment
-        smith_client.create_feedback(
-            run_id= run_id,
-            value = payload,
-            key = column_id,
-            score=score,
-            comment=answer['text']
-        )
+        # and optional comment -- only if the flow was traced (there is no run to attach it to otherwise)
+        if run_id is not None:
+            smith_client.create_feedback(
+                run_id= run_id,
+                value = payload,
+                key = column_id,
+                score=score,
+                comment=answer['text']
+            )
     else:
         st.warning("Invalid feedback score.")    
 
 
 
-@traceable # Auto-trace this function
+@traceable(client = smith_client) # Auto-trace this function
 def summariseData(testing = False): 
     """Takes the extracted answers to questions and generates three scenarios, based on selected prompts. 
 
@@ -288,7 +502,7 @@ def summariseData(testing = False):
     json_parser = SimpleJsonOutputParser()
 
     # connect the prompt with the llm call, and then ensure output is json with our new parser
-    chain = prompt_template | chat | json_parser
+    chain = prompt_template | scenario_chat | json_parser
 
     # ## pick the prompt we want to use 
     # prompt_1 = prompts['prompt_1']
@@ -298,6 +512,9 @@ def summariseData(testing = False):
     # pick the prompt we want to use (counterbalance order)
     prompt_type_1, prompt_type_2, prompt_type_3 = random.sample(['formal', 'youngsib', 'friend'], 3)
     prompt_1, prompt_2, prompt_3 = prompts[prompt_type_1], prompts[prompt_type_2], prompts[prompt_type_3]
+    # keep the persona order so feedback / selection can be analysed per persona
+    st.session_state['persona_order'] = [prompt_type_1, prompt_type_2, prompt_type_3]
+    persona_stats.record_shown(st.session_state['persona_order'])
     # update_db_entry(st.session_state["chat_id"], "prompt_type_1", prompt_type_1)
     # update_db_entry(st.session_state["chat_id"], "prompt_type_2", prompt_type_2)
     # update_db_entry(st.session_state["chat_id"], "prompt_type_3", prompt_type_3)
@@ -306,11 +523,17 @@ def summariseData(testing = False):
     
     end_prompt = end_prompt_core
 
+    ### re-use the answers of an earlier (disconnected) run of this session, or the ones filled during a 'slots' interview, otherwise
     ### call extract choices on real data / stored test data based on value of testing
-    if testing: 
-        answer_set = extractChoices(msgs, True)
-    else:
-        answer_set = extractChoices(msgs, False)
+    answer_set = stage_cache.get(st.session_state['resume_key'], 'extraction')
+    if answer_set is None and interview_mode == 'slots' and not testing:
+        answer_set = dict(st.session_state['interview_slots'])
+    if answer_set is None:
+        if testing: 
+            answer_set = extractChoices(msgs, True)
+        else:
+            answer_set = extractChoices(msgs, False)
+        stage_cache.put(st.session_state['resume_key'], 'extraction', answer_set)
     
     ## debug shows the interrim steps of the extracted set
     if DEBUG: 
@@ -321,6 +544,10 @@ def summariseData(testing = False):
     # store the generated answers into streamlit session state
     st.session_state['answer_set'] = answer_set
 
+    # the one-shot example closest to this participant's story (the lc_prompts example_set if nothing is close)
+    example, example_similarity = example_library.nearest(answer_set)
+    st.session_state['example_id'] = example['id']
+
 
     # let the user know the bot is starting to generate content 
     with entry_messages:
@@ -331,92 +558,87 @@ def summariseData(testing = False):
         st.chat_message("ai").write("Seems I have everything! Let me try to summarise what you said in three scenarios. \n See you if you like any of these! ")
 
 
-        ## can't be bothered to set up LLM stream here, so just showing progress bar for now  
-        ## this gets manually updated after each scenario
-        progress_text = 'Processing your scenarios'
-        bar = st.progress(0, text = progress_text)
-
+    # one column per scenario, filled in as soon as that persona's scenario is ready
+    with scenario_area:
+        scenario_slots = [col.empty() for col in st.columns(3)]
+    for i, slot in enumerate(scenario_slots):
+        with slot.container():
+            st.header(f"Scenario {i + 1}")
+            st.caption("Writing this scenario for you ... ✍️")
 
-    # create first scenario & store into st.session state 
-    st.session_state.response_1 = chain.invoke({
-        "main_prompt" : prompt_1,
+    ## generate the scenario candidates concurrently and show the best one per persona as soon as it is picked (see scenario_ranking.py)
+    scenario_config = {"callbacks": [usage_ledger.callback('scenario')]}
+    persona_inputs = [{
+        "main_prompt" : persona_prompt,
         "end_prompt" : end_prompt,
-        "example_what" : example_set['what'],
-        "example_context" : example_set['context'],
-        "example_outcome" : example_set['outcome'],
-        "example_reaction" : example_set['reaction'],
-        "example_scenario" : example_set['scenario'],
+        "example_what" : example['what'],
+        "example_context" : example['context'],
+        "example_outcome" : example['outcome'],
+        "example_reaction" : example['reaction'],
+        "example_scenario" : example['scenario'],
         "what" : answer_set['what'],
         "context" : answer_set['context'],
         "outcome" : answer_set['outcome'],
         "reaction" : answer_set['reaction']
+    } for persona_prompt in [prompt_1, prompt_2, prompt_3]]
+
+    # show each scenario as soon as it is picked (streamlit calls stay on this thread)
+    def show_scenario(i, response):
+        st.session_state[f'response_{i + 1}'] = response
+        with scenario_slots[i].container():
+            st.header(f"Scenario {i + 1}")
+            st.write(response['output_scenario'])
+            st.caption("You can rate the scenarios once all three are ready.")
+
+    n_candidates = int(st.secrets.get('scenario_candidates', 1))
+    st.session_state['scenario_candidates'] = []
+    generate_ranked(
+        partial(canceller.invoke, chain, config = scenario_config, stage = 'scenario'),
+        persona_inputs,
+        ScenarioScorer(answer_set),
+        show_scenario,
+        n_candidates = n_candidates,
+        max_concurrency = int(st.secrets.get('scenario_concurrency', 3 * n_candidates)),
+        grace = float(st.secrets.get('scenario_candidate_grace', 2.0)),
+        log = st.session_state['scenario_candidates']
+    )
+
+    ## update the correct run ID -- all three calls share the same one (this function's run).
+    run = get_current_run_tree()
+    # no run tree when tracing is switched off ([tracing] enabled = false)
+    st.session_state.run_id = run.id if run else None
+
+    # a reload from here on goes straight back to the review page
+    stage_cache.put(st.session_state['resume_key'], 'scenarios', {
+        key: st.session_state.get(key)
+        for key in ['response_1', 'response_2', 'response_3', 'persona_order', 'example_id', 'scenario_candidates', 'answer_set', 'run_id']
     })
-    run_1 = get_current_run_tree()
-
-    ## update progress bar
-    bar.progress(33, progress_text)
-
-    st.session_state.response_2 = chain.invoke({
-        "main_prompt" : prompt_2,
-        "end_prompt" : end_prompt,
-        "example_what" : example_set['what'],
-        "example_context" : example_set['context'],
-        "example_outcome" : example_set['outcome'],
-        "example_reaction" : example_set['reaction'],
-        "example_scenario" : example_set['scenario'],
-        "what" : answer_set['what'],
-        "context" : answer_set['context'],
-        "outcome" : answer_set['outcome'],
-        "reaction" : answer_set['reaction']
-    })
-    run_2 = get_current_run_tree()
-
-    ## update progress bar
-    bar.progress(66, progress_text)
-
-    st.session_state.response_3 = chain.invoke({
-        "main_prompt" : prompt_3,
-        "end_prompt" : end_prompt,
-        "example_what" : example_set['what'],
-        "example_context" : example_set['context'],
-        "example_outcome" : example_set['outcome'],
-        "example_reaction" : example_set['reaction'],
-        "example_scenario" : example_set['scenario'],
-        "what" : answer_set['what'],
-        "context" : answer_set['context'],
-        "outcome" : answer_set['outcome'],
-        "reaction" : answer_set['reaction']
-    })
-    run_3 = get_current_run_tree()
-
-    ## update progress bar after the last scenario
-    bar.progress(99, progress_text)
-
-    # remove the progress bar
-    # bar.empty()
 
     if DEBUG: 
-        st.session_state.run_collection = {
-            "run1": run_1,
-            "run2": run_2,
-            "run3": run_3
-        }
-
-    ## update the correct run ID -- all three calls share the same one. 
-    st.session_state.run_id = run_1.id
+        st.session_state.run_collection = {"run": run}
 
     ## move the flow to the next state
     st.session_state["agentState"] = "review"
 
-    # we need the user to do an action (e.g., button click) to generate a natural streamlit refresh (so we can show scenarios on a clear page). Other options like streamlit rerun() have been marked as 'failed runs' on Langsmith which is annoying. 
-    st.button("I'm ready -- show me!", key = 'progressButton')
-    
+    # the review page is set up by the caller (see summariseAndReview) once this function has returned, so the LangSmith run is closed normally -- no st.rerun() or extra button click needed
+    return scenario_slots
+
     # Save scenario proposals to the database
     # update_db_entry(st.session_state["chat_id"], "scenario_1", st.session_state.response_1['output_scenario'])
     # update_db_entry(st.session_state["chat_id"], "scenario_2", st.session_state.response_2['output_scenario'])
     # update_db_entry(st.session_state["chat_id"], "scenario_3", st.session_state.response_3['output_scenario'])
 
 
+def summariseAndReview(testing = False):
+    """Generates the scenarios and shows the review page in the same streamlit run.
+
+    summariseData fills in the scenario columns as they arrive; the feedback and selection widgets are added to the same columns afterwards.
+    """
+    scenario_slots = summariseData(testing)
+    with scenario_area:
+        reviewData(testing, scenario_slots)
+
+
 def testing_reviewSetUp():
     """Simple function that just sets up dummy scenario data, used when testing later flows of the process. 
     """
@@ -479,9 +701,19 @@ def click_selection_yes(button_num, scenario):
             'judgment': st.session_state['scenario_decision'],
             'scenarios_all': scenario_dict,
             'chat_history': msgs,
-            'adaptation_list': []
+            'adaptation_list': [],
+            'personas': st.session_state.get('persona_order', []),
+            'selected_column': button_num,
+            'example_id': st.session_state.get('example_id'),
+            'scenario_candidates': log_to_item(st.session_state.get('scenario_candidates', []), st.session_state.get('persona_order', []))
     }
 
+    ## update the live persona counters with the pick and its slider judgment
+    persona_order = st.session_state.get('persona_order')
+    if persona_order:
+        position = int(button_num)
+        persona_stats.record_selection(persona_order[position - 1], position, st.session_state['scenario_decision'])
+
 
 def click_selection_no():
     """ Function called on_submit when a user clicks on 'actually, let me try another one'. 
@@ -539,10 +771,12 @@ def scenario_selection (popover, button_num, scenario):
 
 
 
-def reviewData(testing):
+def reviewData(testing, scenario_slots = None):
     """ Procedure that governs the scenario review and selection by the user. 
 
     It presents the scenarios generated in previous phases (and saved to st.session_state) and sets up the feedback / selection buttons and popovers. 
+
+    scenario_slots (list): placeholders of the three scenario columns, when called straight after summariseData in the same run
     """
 
     ## If we're testing this function, the previous functions have set up the three column structure yet and we don't have scenarios. 
@@ -557,8 +791,11 @@ def reviewData(testing):
 
     ## assuming no scenario has been selected 
     if st.session_state['scenario_selection'] == '0':
-        # setting up space for the scenarios 
-        col1, col2, col3 = st.columns(3)
+        # setting up space for the scenarios (or re-using the columns summariseData has just filled)
+        if scenario_slots is not None:
+            col1, col2, col3 = [slot.container() for slot in scenario_slots]
+        else:
+            col1, col2, col3 = st.columns(3)
         
         ## check if we had any feedback before:
         ## set up a dictionary:
@@ -661,6 +898,10 @@ def reviewData(testing):
 
         # set the flow pointer accordingly 
         st.session_state['agentState'] = 'finalise'
+        # the heavy part of the flow is done -- give the slot to the next participant in the waiting room
+        # (on purpose: the session keeps running without a slot, see the admission check below)
+        admission.release(st.session_state['admission_key'])
+        st.session_state['released'] = True
         # print("ended loop -- should move to finalise!")
         finaliseScenario()
 
@@ -681,7 +922,7 @@ def updateFinalScenario_textEdit (new_scenario):
     st.session_state.scenario_package['judgment'] = "Ready as is!"
 
 
-@traceable
+@traceable(client = smith_client)
 def finaliseScenario():
     """ Procedure governs the last part of the flow, which is the scenario adaptation.
     """
@@ -701,9 +942,27 @@ def finaliseScenario():
         st.markdown(f":green[{package['scenario']}]")
         
         package['chat_history'] = [(msg.type, msg.content) for msg in package['chat_history'].messages]
+        # second redaction pass over everything written by the model or typed in later steps (feedback, edits)
+        package_counts = {}
+        for field in PACKAGE_TEXT_FIELDS:
+            if field in package:
+                package[field], found = redactor.redact_item(package[field])
+                for kind, n in found.items():
+                    package_counts[kind] = package_counts.get(kind, 0) + n
+        package['pii_redactions'] = {'turns': st.session_state['pii_counts'], 'package': package_counts}
+        # flag near-identical stories from earlier sessions & collapsed persona outputs (sub-millisecond lookups)
+        package['near_duplicates'] = check_package(duplicate_indexes, package)
+        package['token_usage'] = usage_ledger.to_item()
+        package['cancelled_stages'] = st.session_state.get('cancelled_stages', [])
+        package['interview_mode'] = interview_mode
         table.put_item(
             Item=package
         )
+        # local columnar copy for analysis -- only queues the package, writing happens on a background thread
+        results_store.append(package)
+        # later sessions with the same pid are turned away at the consent gate
+        completed_participants.add(package['chat_id'])
+        stage_cache.clear(st.session_state['resume_key'])
             # st.session_state.scenario_package = {
                 # 'scenario': scenario,    <- final scenario
                 # 'answer set':  st.session_state['answer_set'],   <- the extracted data
@@ -745,31 +1004,39 @@ def finaliseScenario():
             st.markdown("### Adapt with AI 🦾 :")
             st.chat_message("ai").write("Okay, what's missing or could change to make this better?")
         
-            # once user enters something 
-            if prompt:
-                st.chat_message("human").write(prompt) 
-                # append_list_entry(st.session_state["chat_id"], "editing_chat", {"role": "human", "content": prompt})
+            # once user enters something -- as long as the session has adaptation rounds left in its budget
+            if prompt and budget.adaptations_left(usage_ledger) == 0:
+                st.chat_message("ai").write("Sorry, we can't adapt this scenario with AI any further -- please edit it directly above.")
+
+            elif prompt:
+                # scrub identifying details before the request reaches the model (see pii_redaction.py, as in getData)
+                request_text, found = redactor.redact(prompt)
+                for kind, n in found.items():
+                    st.session_state['pii_counts'][kind] = st.session_state['pii_counts'].get(kind, 0) + n
+
+                st.chat_message("human").write(request_text) 
+                # append_list_entry(st.session_state["chat_id"], "editing_chat", {"role": "human", "content": request_text})
 
                 # use a new chain, drawing on the prompt_adaptation template from lc_prompts.py
                 adaptation_prompt = PromptTemplate(input_variables=["input", "scenario"], template = prompt_adaptation)
                 json_parser = SimpleJsonOutputParser()
 
-                chain = adaptation_prompt | chat | json_parser
+                chain = adaptation_prompt | adaptation_chat | json_parser
 
                 # set up a UX feedback in case the scenario takes longer to generate
                 # note -- spinner disappears once the code inside finishes
                 with st.spinner('Working on your updated scenario 🧐'):
-                    new_response = chain.invoke({
+                    new_response = canceller.invoke(chain, {
                         'scenario': package['scenario'], 
-                        'input': prompt
-                        })
+                        'input': request_text
+                        }, config = {"callbacks": [usage_ledger.callback('adaptation')]}, stage = 'adaptation')
                     # st.write(new_response)
 
                 st.markdown(f"Here is the adapted response: \n :orange[{new_response['new_scenario']}]\n\n **what do you think?**")
                 # append_list_entry(st.session_state["chat_id"], "editing_chat", {"role": "assistant", "content": new_response['new_scenario']})
                 
                 ## save the adaptation step into the package: 
-                st.session_state.scenario_package['adaptation_list'].append([prompt, new_response['new_scenario']])
+                st.session_state.scenario_package['adaptation_list'].append([request_text, new_response['new_scenario']])
                
               
                 c1, c2  = st.columns(2)
@@ -793,11 +1060,23 @@ def finaliseScenario():
 
             
 
+def stageChat(stage):
+    """Chat model for one stage of the flow ('interview', 'extraction', 'scenario', 'adaptation').
+
+    Follows the [model_routing] config; sessions over their budget are degraded to the cheaper fallback model (local endpoints and the local backend are kept as they are free).
+    """
+    route = stage_route(stage, model_routing, st.session_state.llm_model)
+    if route['backend'] == 'openai' and not route['base_url']:
+        route['model'] = budget.model_for(usage_ledger, route['model'])
+    return route_chat(route, openai_api_key)
+
+
 def stateAgent(): 
     """ Main flow function of the whole interaction -- keeps track of the system state and calls the appropriate procedure on each streamlit refresh. 
     """
 
     # testing will ensure using dummy data (rather than user-data collection) to simplify development / testing of later parts of the flow. 
+    # combine with the LLM_CASSETTE secret to also replay the model calls without network access
     testing = False
 
     # keep track of where we are, if testing
@@ -811,7 +1090,7 @@ def stateAgent():
             # summariseData(testing)
             # reviewData(testing)
     elif st.session_state['agentState'] == 'summarise':
-            summariseData(testing)
+            summariseAndReview(testing)
     elif st.session_state['agentState'] == 'review':
             reviewData(testing)
     elif st.session_state['agentState'] == 'finalise':
@@ -819,17 +1098,59 @@ def stateAgent():
 
 
 
+def profiledStateAgent():
+    """Runs stateAgent -- wrapped in the sampling profiler / tracemalloc if profiling was asked for (nothing extra otherwise)."""
+    try:
+        if 'profile' in st.query_params or os.environ.get('PROFILE_RERUNS'):
+            with get_rerun_profiler().profile(st.session_state['chat_id'], lambda: st.session_state['agentState']):
+                stateAgent()
+        else:
+            stateAgent()
+    except SessionGone:
+        # the browser is gone, the model calls were cancelled (see cancelSession) -- nothing left to show
+        pass
+
+
+
+@st.fragment(run_every=3)
+def waitingRoom():
+    """Shows the live queue position while the session waits for a free slot, and starts the flow once admitted."""
+    position = admission.try_admit(st.session_state['admission_key'])
+    if position == 0:
+        st.session_state['admitted'] = True
+        st.rerun()
+
+    st.info(f"Lots of people are taking part right now -- you are number **{position}** in the queue. Please keep this page open, the study will start automatically.")
+
+
 def markConsent():
     """On_submit function that marks the consent progress 
     """
     st.session_state['consent'] = True
+    # make sure the model connection is open before the first interview turn
+    warm_up(os.environ["OPENAI_API_KEY"], model_routing)
 
 if 'pid' not in st.query_params:
     st.write("Sorry, there has been an error collecting your Prolific ID. Please contact the researcher for assistance.")
     st.stop()
 
-### check we have consent -- if so, run normally 
-if st.session_state['consent'] and 'pid' in st.query_params: 
+### participants who already completed the study can't take part again -- checked once per session, before any model call
+if 'repeat_participant' not in st.session_state:
+    st.session_state['repeat_participant'] = completed_participants.has_completed(st.session_state['chat_id'])
+
+if st.session_state['repeat_participant']:
+    st.write("It looks like you have already completed this study -- thank you! Each participant can only take part once. Please contact the researcher if you think this is a mistake.")
+    st.stop()
+
+### once consent is given, the session needs a free slot before the (model-heavy) interview can start
+if st.session_state['consent'] and not st.session_state['admitted']:
+    st.session_state['admitted'] = admission.try_admit(st.session_state['admission_key']) == 0
+elif st.session_state['admitted'] and not st.session_state['released'] and not admission.renew(st.session_state['admission_key']):
+    # the lease expired (e.g. a long pause) and the slot went to someone else -- queue again instead of running uncounted
+    st.session_state['admitted'] = admission.try_admit(st.session_state['admission_key']) == 0
+
+### check we have consent (and a slot) -- if so, run normally 
+if st.session_state['consent'] and st.session_state['admitted'] and 'pid' in st.query_params: 
     
     # setting up the right expanders for the start of the flow
     if st.session_state['agentState'] == 'review':
@@ -837,6 +1158,9 @@ if st.session_state['consent'] and 'pid' in st.query_params:
 
     entry_messages = st.expander("Collecting your story", expanded = st.session_state['exp_data'])
 
+    # main page area for the scenarios -- summariseData fills it in progressively, reviewData adds the feedback widgets
+    scenario_area = st.container()
+
     if st.session_state['agentState'] == 'review':
         review_messages = st.expander("Review Scenarios")
 
@@ -857,7 +1181,10 @@ if st.session_state['consent'] and 'pid' in st.query_params:
 
 
     # Set up the LangChain for data collection, passing in Message History
-    chat = ChatOpenAI(temperature=0.3, model=st.session_state.llm_model, openai_api_key = openai_api_key)
+    # one chat model per stage -- all share the same connection pool
+    chat = stageChat('interview')
+    scenario_chat = stageChat('scenario')
+    adaptation_chat = stageChat('adaptation')
 
     prompt_updated = PromptTemplate(input_variables=["history", "input"], template = prompt_datacollection)
 
@@ -867,13 +1194,23 @@ if st.session_state['consent'] and 'pid' in st.query_params:
         verbose = True,
         memory = memory
         )
+    # used instead of the conversation chain in 'slots' interview mode
+    interviewer = SlotInterviewer(chat)
     
-    # start the flow agent 
-    stateAgent()
+    # start the flow agent -- all runs of this session carry its id, which decides whether the session is sampled for tracing
+    if TRACING:
+        with tracing_context(metadata = {"session_id": st.session_state['admission_key']}), tracing_v2_enabled(client = smith_client):
+            profiledStateAgent()
+    else:
+        profiledStateAgent()
 
-# we don't have consent yet -- ask for agreement and wait 
+# we don't have consent yet -- ask for agreement and wait (or we have it, but are waiting for a free slot)
 else: 
     print("don't have consent!")
+
+    # open the (shared) model connection in the background while the participant reads the welcome page
+    warm_up(os.environ["OPENAI_API_KEY"], model_routing)
+
     consent_message = st.container()
     with consent_message:
         st.markdown(''' 
@@ -885,7 +1222,10 @@ else:
                     
                     \n \n To proceed to the task, please confirm that you have read and understood this information.
         ''')
-        st.button("I accept", key = "consent_button", on_click=markConsent)
+        if st.session_state['consent']:
+            waitingRoom()
+        else:
+            st.button("I accept", key = "consent_button", on_click=markConsent)
            
 
 
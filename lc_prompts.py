@@ -73,6 +73,33 @@ Human: {input}
 AI:
 """
 
+## structured interview (see slot_interview.py) -- every turn returns the reply and the answers picked up so far, no "FINISHED" sentinel
+prompt_slot_interview = """
+You're a high-school counsellor collecting stories from students about their difficult experiences on social media. 
+
+You start with a general question: 
+1. What do you find most challenging about your current social media use?
+
+You proceed to ask the following four questions about a specific experience they had (the key of each answer is in brackets):
+2. What happened? Specifically, what was said, posted, or done? [what]
+3. What's the context? What else should we know about the situation? [context]
+4. How did the situation make you feel, and how did you react? [outcome]
+5. What was the worst part of the situation? [reaction]
+
+Ask each question one at a time, using empathetic and youth-friendly language while maintaining a descriptive tone. Ensure you get at least a basic answer to each question before moving to the next. Never answer for the human. If you unsure what the human meant, ask again.
+
+Answers collected so far: {slots}
+
+Current conversation:
+{history}
+Human: {input}
+
+Respond with a JSON object with three keys: 
+- "reply": your next message to the human
+- "slot_updates": an object with the keys (what, context, outcome, reaction) of the questions the human's latest message answers, each with the human's answer in their own words (include what they said earlier about the same question). Use {{}} if the message answers none of them.
+- "complete": true only once all four answers have been collected -- the reply then thanks the human and asks nothing more
+"""
+
 prompt_adaptation = """
 You're a helpful assistant, helping students adapt a scenario to their liking. The original scenario this student came with: 
 
@@ -166,3 +193,26 @@ extraction_prompt = """You are an expert extraction algorithm.
 
             Remember, only extract text that is in the messages above and do not change it. 
     """
+
+
+## per-slot extraction (see slot_extraction.py) -- one small call per question, run concurrently
+slot_questions = {
+    "what": "What happened? Specifically, what was said, posted, or done?",
+    "context": "What's the context? What else should we know about the situation?",
+    "outcome": "How did the situation make them feel, and how did they react?",
+    "reaction": "What was the worst part of the situation?"
+}
+
+slot_extraction_prompt = """You are an expert extraction algorithm. 
+            Only extract the Human's answer to the following question from the conversation excerpt below:
+            {slot_question}
+
+            Use only the words and phrases that the text contains. 
+            If the Human did not answer this question, return null. 
+
+            You will output a JSON with a single `{slot}` key. 
+
+            Conversation excerpt: {conversation_excerpt}
+
+            Remember, only extract text that is in the messages above and do not change it. 
+    """
@@ -0,0 +1,206 @@
+"""
+LLM clients - shared, pre-warmed HTTP connection pool for all chat models
+
+Every ChatOpenAI in the app is created through make_chat, so all of them share one keep-alive
+httpx client per process (HTTP/2 when the `h2` package is installed, which multiplexes concurrent
+calls over a single TLS connection). warm_up opens the connections in the background -- of both the sync
+client and the async one (used by the cancellable calls, see cancellation.py), to every endpoint the
+[model_routing] config uses. It is triggered from the consent screen, so the DNS / TCP / TLS set-up is paid
+before the first interview turn.
+
+The endpoint is taken from the `openai_base_url` secret / OPENAI_BASE_URL environment variable, which
+allows pointing the app at a local OpenAI-compatible mock server. Setting LLM_CASSETTE records / replays
+all model calls (see cassettes.py).
+
+Each stage of the flow can be routed to its own model via a [model_routing] section in the secrets, e.g.
+
+    [model_routing.extraction]
+    model = "gpt-4o-mini"
+
+    [model_routing.interview]
+    model = "llama3.1:8b"
+    base_url = "http://localhost:11434/v1"    # any local OpenAI-compatible server (ollama, llama.cpp, vLLM)
+
+or, instead of the remote extraction model above, an in-process CPU model (see local_llm.py):
+
+    [model_routing.extraction]
+    backend = "local"
+    model_path = "models/qwen2.5-1.5b-instruct-q4_k_m.gguf"
+
+Stages without an entry use st.session_state.llm_model -- use benchmark_models.py to compare candidates first.
+"""
+
+import os
+import threading
+import time
+
+import asyncio
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from cancellation import get_loop
+from cassettes import transport_from_env
+from local_llm import ChatLocal
+
+try:
+    import h2  # noqa: F401 -- only needed so httpx can negotiate HTTP/2
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+
+# keep idle connections around for longer than a participant typically spends on one interview turn
+KEEPALIVE_EXPIRY = 120
+
+# stages of the flow and their default temperatures (as previously hard-coded in interaction_prototype.py)
+STAGE_TEMPERATURES = {
+    'interview': 0.3,
+    'extraction': 0.1,
+    'scenario': 0.3,
+    'adaptation': 0.3,
+}
+
+_lock = threading.Lock()
+_client = None
+_async_client = None
+_last_warm_up = 0.0
+
+
+def base_url():
+    """The OpenAI-compatible endpoint all chat models talk to."""
+    return os.environ.get('OPENAI_BASE_URL', DEFAULT_BASE_URL).rstrip('/')
+
+
+def get_http_client():
+    """Returns the process-wide keep-alive client (created on first use)."""
+    global _client
+    with _lock:
+        if _client is None:
+            transport = httpx.HTTPTransport(
+                http2=HTTP2,
+                limits=httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=KEEPALIVE_EXPIRY),
+            )
+            _client = httpx.Client(
+                transport=transport_from_env(transport),
+                timeout=httpx.Timeout(120.0, connect=10.0),
+            )
+        return _client
+
+
+def get_async_http_client():
+    """Returns the process-wide async client -- only used from the cancellation event loop (see cancellation.py)."""
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            transport = httpx.AsyncHTTPTransport(
+                http2=HTTP2,
+                limits=httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=KEEPALIVE_EXPIRY),
+            )
+            _async_client = httpx.AsyncClient(
+                transport=transport_from_env(transport),
+                timeout=httpx.Timeout(120.0, connect=10.0),
+            )
+        return _async_client
+
+
+def make_chat(model, temperature, api_key, endpoint=None):
+    """Creates a ChatOpenAI model that uses the shared connection pool.
+
+    Parameters:
+    model (str): model name, e.g. st.session_state.llm_model
+    temperature (float): sampling temperature
+    api_key (str): OpenAI API key
+    endpoint (str): optional OpenAI-compatible base url (e.g. a local model server) instead of base_url()
+    """
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        openai_api_key=api_key,
+        openai_api_base=(endpoint or base_url()).rstrip('/'),
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
+
+
+def stage_route(stage, routing, default_model):
+    """Resolves the model settings of one stage from the [model_routing] config.
+
+    Parameters:
+    stage (str): one of STAGE_TEMPERATURES
+    routing (dict): the [model_routing] section (may be empty)
+    default_model (str): model for stages without their own entry
+
+    Returns:
+    dict with `backend` ('openai' or 'local'), `model`, `temperature`, `base_url` (None for the default endpoint),
+    `api_key` (None for the default key) and `model_path` (GGUF file of the local backend)
+    """
+    config = dict(routing.get(stage, {})) if routing else {}
+    return {
+        'backend': config.get('backend', 'openai'),
+        'model': config.get('model', default_model),
+        'temperature': float(config.get('temperature', STAGE_TEMPERATURES[stage])),
+        'base_url': config.get('base_url'),
+        'api_key': config.get('api_key'),
+        'model_path': config.get('model_path'),
+    }
+
+
+def route_chat(route, api_key):
+    """Creates the chat model for a route returned by stage_route -- an OpenAI-compatible client or the in-process local model."""
+    if route['backend'] == 'local':
+        return ChatLocal(model_path=route['model_path'], temperature=route['temperature'])
+    return make_chat(route['model'], route['temperature'], route['api_key'] or api_key, route['base_url'])
+
+
+def warm_up_endpoints(api_key, routing=None):
+    """The (endpoint, api key) pairs the chat models of all stages talk to -- local-backend stages need no connection."""
+    endpoints = set()
+    for stage in STAGE_TEMPERATURES:
+        route = stage_route(stage, routing, default_model=None)
+        if route['backend'] == 'openai':
+            endpoints.add(((route['base_url'] or base_url()).rstrip('/'), route['api_key'] or api_key))
+    return sorted(endpoints)
+
+
+def _warm_up(api_key, routing):
+    endpoints = warm_up_endpoints(api_key, routing)
+
+    async def warm_async():
+        # the async pool is bound to the cancellation event loop, so it has to be warmed from there
+        for endpoint, key in endpoints:
+            try:
+                await get_async_http_client().get(f'{endpoint}/models', headers={'Authorization': f'Bearer {key}'}, timeout=10.0)
+            except httpx.HTTPError as e:
+                print(f"async connection warm-up of {endpoint} failed: {e}")
+
+    pending = asyncio.run_coroutine_threadsafe(warm_async(), get_loop())
+    for endpoint, key in endpoints:
+        try:
+            # a cheap authenticated request -- opens (and keeps) the connection the chat calls will reuse
+            get_http_client().get(f'{endpoint}/models', headers={'Authorization': f'Bearer {key}'}, timeout=10.0)
+        except httpx.HTTPError as e:
+            print(f"connection warm-up of {endpoint} failed: {e}")
+    try:
+        pending.result(timeout=30)
+    except Exception as e:
+        print(f"async connection warm-up did not finish: {e}")
+
+
+def warm_up(api_key, routing=None):
+    """Warms the connection pools in a background thread -- returns immediately.
+
+    api_key (str): default OpenAI API key
+    routing (dict): the [model_routing] section -- its endpoints are warmed too
+
+    Repeated calls within half the keep-alive window are ignored, so this can be called on every rerun of the consent page.
+    """
+    global _last_warm_up
+    with _lock:
+        now = time.monotonic()
+        if now - _last_warm_up < KEEPALIVE_EXPIRY / 2:
+            return
+        _last_warm_up = now
+    threading.Thread(target=_warm_up, args=(api_key, routing), name='llm-warm-up', daemon=True).start()
@@ -0,0 +1,217 @@
+"""
+Mock OpenAI-compatible server for load tests and offline runs
+
+Answers `POST /v1/chat/completions` (and `GET /v1/models`, used by the connection warm-up) with canned
+or replayed responses after a configurable, randomly drawn latency. The kind of call is recognised from
+the prompt text, so the whole app flow works against it:
+- interview turns        -> short follow-up questions, then "FINISHED" after --interview-turns human answers
+- prompt_slot_interview  -> JSON with `reply`, `slot_updates` (one slot per answer to questions 2-5) and `complete`
+- extraction_prompt      -> JSON with `what`, `context`, `outcome`, `reaction`
+- slot_extraction_prompt -> JSON with the single requested slot
+- prompt_one_shot        -> JSON with `output_scenario`
+- prompt_adaptation      -> JSON with `new_scenario`
+
+It also accepts DynamoDB JSON-protocol requests on `POST /` (PutItem / GetItem / Query / Scan) and answers them
+as an always-empty table, so `table.put_item` works without AWS (set the DYNAMODB_ENDPOINT_URL secret to this server).
+
+Usage:
+    python loadtest/mock_openai_server.py --port 8089 --latency lognormal:1.0,0.5
+    python loadtest/mock_openai_server.py --latency fixed:0.2 --replay recorded_responses.jsonl
+
+Latency specs: `fixed:<s>`, `uniform:<low>,<high>`, `lognormal:<median s>,<sigma>`.
+Replay files are JSONL with `{"kind": "interview|slot_interview|extraction|slot_extraction|scenario|adaptation", "content": "..."}` lines,
+served round-robin per kind (optionally with a recorded `"latency"` in seconds, used instead of the drawn one).
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import re
+import time
+import uuid
+
+from aiohttp import web
+
+
+INTERVIEW_QUESTIONS = [
+    "Thanks for being here! What do you find most challenging about your current social media use?",
+    "That sounds hard. Can you tell me about a specific time -- what happened? What was said, posted, or done?",
+    "What's the context? What else should we know about the situation?",
+    "How did the situation make you feel, and how did you react?",
+    "What was the worst part of the situation?",
+]
+
+EXTRACTION = {
+    "what": "Someone posted an embarrassing photo of me in the class group chat.",
+    "context": "We had an argument the day before.",
+    "outcome": "I felt hurt and angry, and I left the group chat.",
+    "reaction": "Everyone I know saw it before I could do anything.",
+}
+
+# the slot each interview question (INTERVIEW_QUESTIONS[1:]) fills in a 'slots' interview
+SLOTS = ['what', 'context', 'outcome', 'reaction']
+
+_SLOT_REQUEST = re.compile(r"single `(\w+)` key")
+
+SCENARIO = (
+    "Recently someone in my class posted an embarrassing photo of me in our group chat, the day after we argued. "
+    "I felt hurt and angry and ended up leaving the chat. The worst part was knowing everyone had already seen it."
+)
+
+
+def parse_latency(spec):
+    """Turns a latency spec into a function returning a delay in seconds."""
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',') if v]
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"unknown latency spec: {spec}")
+
+
+def classify(prompt):
+    """Recognises which of the app's prompts a request was built from."""
+    if '"slot_updates"' in prompt:
+        return 'slot_interview'
+    if 'expert extraction algorithm' in prompt:
+        return 'slot_extraction' if _SLOT_REQUEST.search(prompt) else 'extraction'
+    if 'output_scenario' in prompt:
+        return 'scenario'
+    if 'new_scenario' in prompt:
+        return 'adaptation'
+    return 'interview'
+
+
+class MockState:
+
+    def __init__(self, args):
+        self.draw_latency = parse_latency(args.latency)
+        self.interview_turns = args.interview_turns
+        self.replay = {}
+        if args.replay:
+            recorded = {}
+            with open(args.replay) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        recorded.setdefault(record['kind'], []).append(record)
+            self.replay = {kind: itertools.cycle(records) for kind, records in recorded.items()}
+        self.requests = 0
+
+    def respond(self, prompt):
+        """Returns (content, latency) for a prompt."""
+        kind = classify(prompt)
+        if kind in self.replay:
+            record = next(self.replay[kind])
+            return record['content'], record.get('latency', self.draw_latency())
+
+        # both interview prompts list every earlier human turn, and the current one, as 'Human: ...'
+        human_turns = max(1, prompt.count('Human:'))
+
+        if kind == 'extraction':
+            content = json.dumps(EXTRACTION)
+        elif kind == 'slot_extraction':
+            slot = _SLOT_REQUEST.search(prompt).group(1)
+            content = json.dumps({slot: EXTRACTION.get(slot)})
+        elif kind == 'slot_interview':
+            content = json.dumps(self.slot_turn(human_turns))
+        elif kind == 'scenario':
+            content = json.dumps({'output_scenario': SCENARIO})
+        elif kind == 'adaptation':
+            content = json.dumps({'new_scenario': SCENARIO + " I'm still figuring out what to do next."})
+        else:
+            if human_turns > self.interview_turns:
+                content = 'FINISHED'
+            else:
+                content = INTERVIEW_QUESTIONS[min(human_turns, len(INTERVIEW_QUESTIONS)) - 1]
+        return content, self.draw_latency()
+
+    def slot_turn(self, human_turns):
+        """One structured interview turn: the answer to question n (n >= 2) fills slot n - 2."""
+        answered = human_turns - 2
+        updates = {SLOTS[answered]: EXTRACTION[SLOTS[answered]]} if 0 <= answered < len(SLOTS) else {}
+        # complete once every slot has been answered and the configured number of turns is reached
+        if human_turns >= max(len(SLOTS) + 1, self.interview_turns):
+            return {'reply': "Thank you for sharing your experience with me.", 'slot_updates': updates, 'complete': True}
+        reply = INTERVIEW_QUESTIONS[human_turns] if human_turns < len(INTERVIEW_QUESTIONS) else "Is there anything else you'd like to add?"
+        return {'reply': reply, 'slot_updates': updates, 'complete': False}
+
+
+async def chat_completions(request):
+    state = request.app['state']
+    state.requests += 1
+    body = await request.json()
+    prompt = '\n'.join(str(m.get('content', '')) for m in body.get('messages', []))
+
+    content, latency = state.respond(prompt)
+    await asyncio.sleep(latency)
+
+    # rough token counts (~4 characters per token) so token accounting has something to book
+    prompt_tokens = max(1, len(prompt) // 4)
+    completion_tokens = max(1, len(content) // 4)
+    return web.json_response({
+        'id': f'chatcmpl-{uuid.uuid4().hex}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'mock'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop',
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        },
+    })
+
+
+async def models(request):
+    return web.json_response({'object': 'list', 'data': [{'id': 'gpt-4o', 'object': 'model'}, {'id': 'gpt-4o-mini', 'object': 'model'}]})
+
+
+async def dynamodb(request):
+    """Minimal DynamoDB stand-in: accepts writes and behaves like an empty table for reads."""
+    target = request.headers.get('X-Amz-Target', '').split('.')[-1]
+    await request.read()
+    if target in ('Scan', 'Query'):
+        payload = {'Items': [], 'Count': 0, 'ScannedCount': 0}
+    else:
+        payload = {}
+    return web.json_response(payload, content_type='application/x-amz-json-1.0')
+
+
+def make_app(args):
+    app = web.Application(client_max_size=32 * 1024 * 1024)
+    app['state'] = MockState(args)
+    app.router.add_post('/v1/chat/completions', chat_completions)
+    app.router.add_get('/v1/models', models)
+    app.router.add_post('/', dynamodb)
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Mock OpenAI-compatible (and DynamoDB) server for load tests.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', default='lognormal:1.0,0.5', help='fixed:<s> | uniform:<low>,<high> | lognormal:<median>,<sigma>')
+    parser.add_argument('--interview-turns', type=int, default=5, help='human answers before the interview returns FINISHED')
+    parser.add_argument('--replay', help='JSONL file of recorded responses to serve instead of the canned ones')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    web.run_app(make_app(args), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
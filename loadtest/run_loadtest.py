@@ -0,0 +1,233 @@
+"""
+Load test - drives simulated participants through interaction_prototype.py
+
+Starts the mock server (mock_openai_server.py) in-process, then runs N simulated participants concurrently,
+each one a streamlit AppTest of the real app going through consent -> interview -> summarise -> review -> finalise.
+All participants share this process, exactly like sessions share one streamlit worker.
+
+Reports sessions per minute, p50 / p95 / p99 latency per stage and the resident memory of the worker.
+With --ramp the concurrency is doubled until throughput stops growing (or p95 of a stage exceeds
+--max-p95), which is reported as the saturation point.
+
+Usage (from the repository root):
+    python loadtest/run_loadtest.py --participants 20 --concurrency 5
+    python loadtest/run_loadtest.py --ramp --max-concurrency 64 --latency lognormal:1.0,0.5
+    python loadtest/run_loadtest.py --interview-mode slots --extraction-mode per_slot
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import psutil
+from aiohttp import web
+from streamlit.testing.v1 import AppTest
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(LOADTEST_DIR)
+APP_PATH = os.path.join(REPO_DIR, 'interaction_prototype.py')
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, LOADTEST_DIR)
+
+import mock_openai_server
+
+
+STAGES = ['consent', 'waiting', 'interview', 'summarise', 'review', 'select', 'finalise']
+
+ANSWERS = [
+    "I'm ready",
+    "Keeping up with group chats all the time.",
+    "Someone posted an embarrassing photo of me in the class group chat.",
+    "We had an argument the day before.",
+    "I felt hurt and angry and left the chat.",
+    "Everyone saw it before I could do anything.",
+    "That's everything.",
+    "Nothing else to add.",
+]
+
+
+def start_mock_server(args):
+    """Runs the mock server on a background event loop and returns its base URL."""
+    server_args = mock_openai_server.parse_args([
+        '--port', str(args.port), '--latency', args.latency, '--interview-turns', str(args.interview_turns),
+    ] + (['--replay', args.replay] if args.replay else []))
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(mock_openai_server.make_app(server_args))
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', args.port).start())
+        loop.run_forever()
+
+    threading.Thread(target=serve, name='mock-server', daemon=True).start()
+    time.sleep(0.5)
+    return f'http://127.0.0.1:{args.port}'
+
+
+def make_app_test(base_url, pid, extra_secrets=None):
+    at = AppTest.from_file(APP_PATH, default_timeout=300)
+    at.secrets['OPENAI_API_KEY'] = 'sk-loadtest'
+    at.secrets['openai_api_key'] = 'sk-loadtest'
+    at.secrets['openai_base_url'] = f'{base_url}/v1'
+    at.secrets['LANGCHAIN_API_KEY'] = 'loadtest'
+    at.secrets['LANGCHAIN_PROJECT'] = 'loadtest'
+    at.secrets['AWS_ACCESS_KEY_ID'] = 'loadtest'
+    at.secrets['AWS_SECRET_ACCESS_KEY'] = 'loadtest'
+    at.secrets['AWS_DEFAULT_REGION'] = 'eu-west-2'
+    at.secrets['DYNAMODB_ENDPOINT_URL'] = base_url
+    for key, value in (extra_secrets or {}).items():
+        at.secrets[key] = value
+    at.query_params['pid'] = pid
+    return at
+
+
+def run_participant(base_url, pid, timings, extra_secrets=None, max_wait=600):
+    """Runs one participant through the whole flow, appending (stage, seconds) to timings. Returns True on success."""
+
+    def timed(stage, action):
+        start = time.perf_counter()
+        action()
+        timings.append((stage, time.perf_counter() - start))
+
+    at = make_app_test(base_url, pid, extra_secrets)
+    timed('consent', at.run)
+    timed('consent', lambda: at.button(key='consent_button').click().run())
+
+    ## above the app's max_active, sessions sit in the waiting room (no chat input) -- poll like the page does
+    if not at.session_state['admitted']:
+        start = time.perf_counter()
+        while not at.session_state['admitted']:
+            if time.perf_counter() - start > max_wait:
+                return False
+            time.sleep(1)
+            at.run()
+        timings.append(('waiting', time.perf_counter() - start))
+
+    ## interview -- answer until the app moves on to the scenarios
+    for answer in ANSWERS:
+        before = at.session_state['agentState']
+        stage = 'interview'
+        timed(stage, lambda: at.chat_input[0].set_value(answer).run())
+        if at.session_state['agentState'] != before:
+            # this turn returned FINISHED and ran extraction + scenario generation
+            stage_time = timings.pop()[1]
+            timings.append(('summarise', stage_time))
+            break
+    else:
+        return False
+
+    ## older flow: a button press is needed to show the review page
+    buttons = [b for b in at.button if b.key == 'progressButton']
+    if buttons:
+        timed('review', lambda: buttons[0].click().run())
+
+    timed('select', lambda: at.select_slider(key='slider_1').set_value("Ready as is!").run())
+    timed('finalise', lambda: at.button(key='yeskey_1').click().run())
+
+    return not at.exception and at.session_state['agentState'] == 'finalise'
+
+
+def run_level(base_url, participants, concurrency, run_tag, extra_secrets=None):
+    """Runs `participants` sessions with the given concurrency and returns the measurements."""
+    timings = []
+    process = psutil.Process()
+    peak_rss = [process.memory_info().rss]
+    stop = threading.Event()
+
+    def sample_memory():
+        while not stop.wait(0.5):
+            peak_rss[0] = max(peak_rss[0], process.memory_info().rss)
+
+    threading.Thread(target=sample_memory, daemon=True).start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(
+            lambda i: run_participant(base_url, f'loadtest-{run_tag}-{concurrency}-{i}', timings, extra_secrets),
+            range(participants),
+        ))
+    elapsed = time.perf_counter() - start
+    stop.set()
+
+    per_stage = {}
+    for stage, seconds in timings:
+        per_stage.setdefault(stage, []).append(seconds)
+
+    return {
+        'concurrency': concurrency,
+        'completed': sum(results),
+        'failed': len(results) - sum(results),
+        'sessions_per_minute': 60 * sum(results) / elapsed,
+        'latency': {
+            stage: np.percentile(np.array(values), [50, 95, 99]) for stage, values in per_stage.items()
+        },
+        'peak_rss_mb': peak_rss[0] / 2**20,
+    }
+
+
+def print_report(result):
+    print(f"\n== concurrency {result['concurrency']}: {result['completed']} completed, {result['failed']} failed, "
+          f"{result['sessions_per_minute']:.1f} sessions/min, peak RSS {result['peak_rss_mb']:.0f} MB")
+    print(f"{'stage':<12}{'p50 (s)':>10}{'p95 (s)':>10}{'p99 (s)':>10}")
+    for stage in STAGES:
+        if stage in result['latency']:
+            p50, p95, p99 = result['latency'][stage]
+            print(f"{stage:<12}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent load test of the study app against a mock OpenAI server.')
+    parser.add_argument('--participants', type=int, default=20, help='sessions per concurrency level')
+    parser.add_argument('--concurrency', type=int, default=5)
+    parser.add_argument('--ramp', action='store_true', help='double the concurrency until saturation')
+    parser.add_argument('--max-concurrency', type=int, default=64)
+    parser.add_argument('--max-p95', type=float, default=20.0, help='a stage p95 above this (seconds) counts as saturated')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', default='lognormal:1.0,0.5')
+    parser.add_argument('--interview-turns', type=int, default=5)
+    parser.add_argument('--replay', help='JSONL of recorded responses for the mock server')
+    parser.add_argument('--max-active', type=int, help="the app's [admission] max_active (default: the app's own) -- "
+                                                        "sessions above it wait in the waiting room, which is timed as 'waiting'")
+    parser.add_argument('--interview-mode', choices=['chat', 'slots'], help="the app's interview_mode (default: the app's own)")
+    parser.add_argument('--extraction-mode', choices=['single', 'per_slot'], help="the app's extraction_mode (default: the app's own)")
+    args = parser.parse_args()
+
+    base_url = start_mock_server(args)
+
+    extra_secrets = {}
+    if args.max_active is not None:
+        extra_secrets['admission'] = {'max_active': args.max_active}
+    if args.interview_mode:
+        extra_secrets['interview_mode'] = args.interview_mode
+    if args.extraction_mode:
+        extra_secrets['extraction_mode'] = args.extraction_mode
+    run_tag = time.strftime('%H%M%S')
+
+    if not args.ramp:
+        print_report(run_level(base_url, args.participants, args.concurrency, run_tag, extra_secrets))
+        return
+
+    ## ramp: saturation is where doubling the concurrency no longer adds >10% throughput, or latency gets unacceptable
+    best = None
+    concurrency = 1
+    while concurrency <= args.max_concurrency:
+        result = run_level(base_url, max(args.participants, concurrency), concurrency, run_tag, extra_secrets)
+        print_report(result)
+        worst_p95 = max(p[1] for p in result['latency'].values())
+        if best is not None and (result['sessions_per_minute'] < 1.1 * best['sessions_per_minute'] or worst_p95 > args.max_p95):
+            print(f"\nsaturation at concurrency ~{best['concurrency']} "
+                  f"({best['sessions_per_minute']:.1f} sessions/min; next level: {result['sessions_per_minute']:.1f} sessions/min, worst p95 {worst_p95:.1f}s)")
+            return
+        best = result
+        concurrency *= 2
+    print(f"\nno saturation up to concurrency {args.max_concurrency}")
+
+
+if __name__ == '__main__':
+    main()
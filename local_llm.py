@@ -0,0 +1,168 @@
+"""
+Local LLM - CPU-only chat model backed by a quantised GGUF model (llama-cpp-python)
+
+ChatLocal is a LangChain chat model, so it drops into any chain in place of ChatOpenAI -- it is meant for the
+extraction stage and for offline development / test / load-test runs (no GPU, no network, no API key).
+
+Models are kept resident: each GGUF file is loaded once per process (get_local_model) and owned by a single
+worker thread, as a llama.cpp context can only run one evaluation at a time. Concurrent sessions put their
+requests on the worker's queue; the worker takes them in micro-batches:
+- identical requests within a batch (same messages and sampling settings) are evaluated once
+- requests are ordered so that ones sharing a prompt prefix run back to back, and the prefix KV cache
+  (LlamaRAMCache) lets every extraction call skip re-evaluating the long common extraction_prompt
+For true multi-sequence batching, run llama.cpp's server with `--parallel N` instead and route the stage to it
+with `base_url` (see llm_clients.py).
+
+Routing a stage to the in-process model in the secrets:
+
+    [model_routing.extraction]
+    backend = "local"
+    model_path = "models/qwen2.5-1.5b-instruct-q4_k_m.gguf"
+
+llama-cpp-python is an optional dependency (`pip install llama-cpp-python`), imported only when a local model is loaded.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+try:
+    from llama_cpp import Llama, LlamaRAMCache
+except ImportError:
+    Llama = None
+
+
+# llama.cpp's chat roles for the LangChain message types
+ROLES = {'human': 'user', 'ai': 'assistant', 'system': 'system'}
+
+# requests arriving within this window are handled as one batch
+BATCH_WAIT = 0.02
+
+# per-model prompt prefix cache
+CACHE_BYTES = 2 * 2**30
+
+_lock = threading.Lock()
+_models = {}
+
+
+class LocalModel:
+    """One resident llama.cpp model and the worker thread that owns it.
+
+    Parameters:
+    model_path (str): GGUF file
+    n_ctx (int): context window (the extraction prompt plus a full interview fits into 8k)
+    n_threads (int): CPU threads used by llama.cpp (default: all cores)
+    max_batch (int): max requests taken from the queue at once
+    """
+
+    def __init__(self, model_path, n_ctx=8192, n_threads=None, max_batch=16):
+        if Llama is None:
+            raise ImportError("the local backend needs llama-cpp-python: pip install llama-cpp-python")
+        self.model_path = model_path
+        self.name = os.path.basename(model_path)
+        self.max_batch = max_batch
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads or os.cpu_count(), n_gpu_layers=0, verbose=False)
+        self.llm.set_cache(LlamaRAMCache(capacity_bytes=CACHE_BYTES))
+        self.requests = queue.Queue()
+        threading.Thread(target=self._work, name=f'local-llm-{self.name}', daemon=True).start()
+
+    def submit(self, messages, temperature, max_tokens, stop):
+        """Queues one chat completion and returns a Future of the llama.cpp response dict."""
+        future = Future()
+        self.requests.put(((tuple((m['role'], m['content']) for m in messages), temperature, max_tokens, tuple(stop or ())), future))
+        return future
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        try:
+            while len(batch) < self.max_batch:
+                batch.append(self.requests.get(timeout=BATCH_WAIT))
+        except queue.Empty:
+            pass
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+
+            ## identical requests share one evaluation
+            waiting = {}
+            for key, future in batch:
+                waiting.setdefault(key, []).append(future)
+
+            # sorted by prompt, so requests with a common prefix follow each other and hit the prefix cache
+            for key in sorted(waiting, key=lambda k: k[0]):
+                messages, temperature, max_tokens, stop = key
+                try:
+                    response = self.llm.create_chat_completion(
+                        messages=[{'role': role, 'content': content} for role, content in messages],
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stop=list(stop) or None,
+                    )
+                except Exception as e:
+                    for future in waiting[key]:
+                        future.set_exception(e)
+                    continue
+                for future in waiting[key]:
+                    future.set_result(response)
+
+
+def get_local_model(model_path, **kwargs):
+    """Returns the resident model for a GGUF file (loaded on first use, then shared by all sessions of the process)."""
+    with _lock:
+        if model_path not in _models:
+            _models[model_path] = LocalModel(model_path, **kwargs)
+        return _models[model_path]
+
+
+class ChatLocal(BaseChatModel):
+    """LangChain chat model running on the process-wide resident LocalModel.
+
+    Parameters:
+    model_path (str): GGUF file
+    temperature (float): sampling temperature
+    max_tokens (int): max tokens to generate per call
+    n_ctx / n_threads: passed on when the model is loaded
+    """
+
+    model_path: str
+    temperature: float = 0.1
+    max_tokens: int = 1024
+    n_ctx: int = 8192
+    n_threads: Optional[int] = None
+
+    @property
+    def _llm_type(self):
+        return 'llama-cpp-local'
+
+    @property
+    def _identifying_params(self):
+        return {'model_path': self.model_path, 'temperature': self.temperature, 'max_tokens': self.max_tokens}
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs):
+        model = get_local_model(self.model_path, n_ctx=self.n_ctx, n_threads=self.n_threads)
+        chat = [{'role': ROLES.get(m.type, 'user'), 'content': m.content} for m in messages]
+        response = model.submit(chat, kwargs.get('temperature', self.temperature), kwargs.get('max_tokens', self.max_tokens), stop).result()
+
+        usage = response.get('usage') or {}
+        message = AIMessage(
+            content=response['choices'][0]['message']['content'] or '',
+            usage_metadata={
+                'input_tokens': usage.get('prompt_tokens', 0),
+                'output_tokens': usage.get('completion_tokens', 0),
+                'total_tokens': usage.get('total_tokens', 0),
+            },
+        )
+        # same llm_output shape as ChatOpenAI, so the token accounting callbacks work unchanged
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            # 'local:' -- priced as free in token_accounting.PRICES
+            llm_output={'token_usage': usage, 'model_name': f'local:{model.name}'},
+        )
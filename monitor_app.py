@@ -0,0 +1,61 @@
+"""
+Study monitor - lightweight Streamlit page for watching persona performance in a running study
+
+Reads the snapshot files written by persona_stats.PersonaStats (no database access) and refreshes every few seconds.
+
+Run with:
+    streamlit run monitor_app.py
+"""
+
+import pandas as pd
+import streamlit as st
+
+from persona_stats import PERSONAS, POSITIONS, SLIDER_OPTIONS, merge_snapshots, rates
+
+
+snapshot_dir = st.secrets.get('PERSONA_STATS_DIR', 'persona_stats') if st.secrets.load_if_toml_exists() else 'persona_stats'
+
+st.set_page_config(page_title="Study monitor", page_icon="📊", layout="wide")
+st.title("📊 Study monitor")
+
+
+@st.fragment(run_every=10)
+def showStats():
+    """Renders the merged snapshot -- re-run every 10 seconds by streamlit."""
+    merged = merge_snapshots(snapshot_dir)
+    counts = merged['counts']
+
+    st.metric("Review pages shown", merged['sessions'])
+    st.caption("Instances: " + ", ".join(f"{name} (updated {updated})" for name, updated in merged['instances']))
+
+    ## per persona
+    rows = []
+    for persona in PERSONAS:
+        c = counts.get(persona)
+        if c is None:
+            continue
+        rows.append({'persona': persona, 'shown': c['shown'], 'rated': c['rated'], 'selected': c['selected'], **rates(c)})
+    st.subheader("By persona")
+    st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+
+    ## per persona and display position -- to spot order effects
+    rows = []
+    for persona in PERSONAS:
+        for position in POSITIONS:
+            c = counts.get(f'{persona}@{position}')
+            if c is None:
+                continue
+            rows.append({'persona': persona, 'position': position, 'shown': c['shown'], 'rated': c['rated'], 'selected': c['selected'], **rates(c)})
+    st.subheader("By persona and position")
+    st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+
+    ## slider judgments of the selected scenarios
+    slider = pd.DataFrame(
+        {persona: [counts.get(persona, {}).get('slider', {}).get(option, 0) for option in SLIDER_OPTIONS] for persona in PERSONAS},
+        index=SLIDER_OPTIONS,
+    )
+    st.subheader("Slider judgment of the selected scenario")
+    st.bar_chart(slider.T)
+
+
+showStats()
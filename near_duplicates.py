@@ -0,0 +1,224 @@
+"""
+Near-duplicate detection - MinHash / LSH index over collected narratives
+
+Texts are normalised, cut into character shingles and hashed with vectorised NumPy code into a
+MinHash signature. Signatures are split into bands and bucketed (locality-sensitive hashing),
+so a lookup only compares against the few documents sharing a bucket instead of all n of them.
+
+Used in two places:
+- at finalise time (see finaliseScenario): the participant's answers are checked against all earlier
+  sessions, and the three persona scenarios against each other, before the session is stored
+- in bulk over an export (export_sessions.py / results_store.py layout):
+      python near_duplicates.py exports/sessions --threshold 0.8
+"""
+
+import argparse
+import re
+import threading
+
+import numpy as np
+
+
+# prime just above 2**32 -- a * x for 32 bit a and x still fits into uint64
+_PRIME = np.uint64(4294967311)
+_MAX_HASH = np.uint64(2**32 - 1)
+
+_WS = re.compile(r'\s+')
+_NON_WORD = re.compile(r'[^\w\s]')
+
+
+def normalise(text):
+    """Lowercases, strips punctuation and collapses whitespace."""
+    return _WS.sub(' ', _NON_WORD.sub('', str(text).lower())).strip()
+
+
+def shingle_hashes(text, k=5):
+    """Hashes all character k-shingles of the (normalised) text into unique uint32 values -- no python loop over shingles."""
+    data = np.frombuffer(normalise(text).encode('utf-8'), dtype=np.uint8)
+    if len(data) < k:
+        data = np.pad(data, (0, k - len(data)))
+    windows = np.lib.stride_tricks.sliding_window_view(data, k).astype(np.uint64)
+    # polynomial rolling hash of every window at once (uint64 arithmetic wraps, which is fine for hashing)
+    powers = np.uint64(257) ** np.arange(k - 1, -1, -1, dtype=np.uint64)
+    hashes = (windows * powers).sum(axis=1) & _MAX_HASH
+    return np.unique(hashes)
+
+
+class MinHashLSH:
+    """Incremental MinHash / LSH index.
+
+    Parameters:
+    num_perm (int): length of the MinHash signature
+    bands (int): number of LSH bands (num_perm must be divisible by it) -- with r = num_perm / bands rows per band,
+                 pairs with Jaccard similarity s become candidates with probability 1 - (1 - s^r)^bands
+    threshold (float): minimum estimated Jaccard similarity for a candidate to be reported
+    shingle_size (int): characters per shingle
+    seed (int): seed for the hash permutations -- indexes built with different seeds are not comparable
+    """
+
+    def __init__(self, num_perm=128, bands=32, threshold=0.8, shingle_size=5, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2**32, size=(num_perm, 1), dtype=np.uint64)
+        self.b = rng.integers(0, 2**32, size=(num_perm, 1), dtype=np.uint64)
+
+        self.lock = threading.Lock()
+        self.keys = []
+        self.signatures = np.empty((0, num_perm), dtype=np.uint64)
+        self.buckets = [dict() for _ in range(bands)]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def signature(self, text):
+        """MinHash signature of a text -- (num_perm x n_shingles) permutation matrix reduced with min."""
+        shingles = shingle_hashes(text, self.shingle_size)[np.newaxis, :]
+        permuted = ((self.a * shingles) % _PRIME + self.b) % _PRIME
+        return permuted.min(axis=1)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def insert(self, key, text):
+        """Adds one document to the index."""
+        self._add(key, self.signature(text))
+
+    def _add(self, key, signature):
+        with self.lock:
+            doc_id = len(self.keys)
+            self.keys.append(key)
+            # amortised growth of the signature matrix (doubling) so inserts stay O(1)
+            if doc_id >= self.signatures.shape[0]:
+                grown = np.empty((max(16, 2 * (doc_id + 1)), self.num_perm), dtype=np.uint64)
+                grown[:doc_id] = self.signatures[:doc_id]
+                self.signatures = grown
+            self.signatures[doc_id] = signature
+            for band, band_key in enumerate(self._band_keys(signature)):
+                self.buckets[band].setdefault(band_key, []).append(doc_id)
+
+    def query(self, text, exclude=None):
+        """Returns [(key, estimated jaccard)] of indexed documents similar to the text, most similar first.
+
+        Parameters:
+        text (str): document to look up
+        exclude (str): optional key to skip (e.g. the same session when a page is re-run)
+        """
+        return self._query_signature(self.signature(text), exclude)
+
+    def _query_signature(self, signature, exclude=None):
+        with self.lock:
+            candidates = set()
+            for band, band_key in enumerate(self._band_keys(signature)):
+                candidates.update(self.buckets[band].get(band_key, ()))
+            if not candidates:
+                return []
+            ids = np.fromiter(candidates, dtype=np.int64)
+            similarity = (self.signatures[ids] == signature).mean(axis=1)
+            keys = [self.keys[i] for i in ids]
+
+        results = [(key, float(sim)) for key, sim in zip(keys, similarity) if sim >= self.threshold and key != exclude]
+        return sorted(results, key=lambda r: -r[1])
+
+    def insert_and_query(self, key, text):
+        """Looks the text up and then adds it -- the usual pattern for streaming data."""
+        signature = self.signature(text)
+        matches = self._query_signature(signature, exclude=key)
+        self._add(key, signature)
+        return matches
+
+
+def answer_text(answer_set):
+    """Joins the extracted answers of a session into one document."""
+    if isinstance(answer_set, dict):
+        return ' '.join(str(v) for v in answer_set.values() if v)
+    return str(answer_set or '')
+
+
+def session_key(chat_id, timestamp):
+    """Index key of a session -- the pid alone is not unique when a participant comes back."""
+    return f'{chat_id}|{timestamp}'
+
+
+def make_indexes(threshold=0.8):
+    """Separate indexes for participant answers and generated scenarios (a scenario is meant to resemble its answers)."""
+    return {'answers': MinHashLSH(threshold=threshold), 'scenarios': MinHashLSH(threshold=threshold)}
+
+
+def check_package(indexes, package):
+    """Flags near duplicates for one finalised scenario package and adds it to the indexes.
+
+    Checks the participant's answers against earlier sessions, and the three persona scenarios against each other
+    (a collapsed persona) and against earlier sessions.
+
+    Returns:
+    dict with the matching keys -- `answers` (earlier sessions with near-identical answers, as 'chat_id|timestamp') and
+    `scenarios` (e.g. '1~2' for two near-identical columns, or '2~chat_id|timestamp|1' for a match with an earlier session)
+    """
+    session = session_key(package.get('chat_id'), package.get('timestamp'))
+    flags = {'answers': [], 'scenarios': []}
+
+    answers = answer_text(package.get('answer set'))
+    if answers.strip() and not answers.startswith('Testing'):
+        matches = indexes['answers'].insert_and_query(session, answers)
+        flags['answers'] = [key for key, _ in matches]
+
+    ## each column is compared with the earlier columns of this session and with all earlier sessions
+    scenarios_all = package.get('scenarios_all') or {}
+    for i in (1, 2, 3):
+        text = scenarios_all.get(f'col{i}')
+        if not text:
+            continue
+        for key, _ in indexes['scenarios'].insert_and_query(f'{session}|{i}', text):
+            other_session, other_col = key.rsplit('|', 1)
+            flags['scenarios'].append(f'{other_col}~{i}' if other_session == session else f'{i}~{other_session}|{other_col}')
+
+    return flags
+
+
+def index_dataset(indexes, root):
+    """Adds all sessions of a dataset to the indexes, yielding every flagged pair (kind, key, matching key, similarity) on the way.
+
+    Parameters:
+    indexes (dict): as returned by make_indexes
+    root (str): dataset directory (export_sessions.py output or the local results store)
+    """
+    from results_store import read_sessions
+
+    slots = ['answer_what', 'answer_context', 'answer_outcome', 'answer_reaction']
+    columns = ['chat_id', 'timestamp'] + slots + ['scenario_1', 'scenario_2', 'scenario_3']
+    data = read_sessions(root, columns).to_pydict()
+
+    for row in range(len(data['chat_id'])):
+        session = session_key(data['chat_id'][row], data['timestamp'][row])
+        answers = ' '.join(data[c][row] or '' for c in slots)
+        if answers.strip():
+            for other, sim in indexes['answers'].insert_and_query(session, answers):
+                yield 'answers', session, other, sim
+        for i in (1, 2, 3):
+            text = data[f'scenario_{i}'][row]
+            if text:
+                key = f'{session}|{i}'
+                for other, sim in indexes['scenarios'].insert_and_query(key, text):
+                    yield 'scenarios', key, other, sim
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flag near-duplicate narratives and scenarios in an exported dataset.')
+    parser.add_argument('root', help='dataset directory (export_sessions.py output or the local results store)')
+    parser.add_argument('--threshold', type=float, default=0.8, help='minimum estimated Jaccard similarity')
+    args = parser.parse_args()
+
+    indexes = make_indexes(args.threshold)
+    for kind, key, other, sim in index_dataset(indexes, args.root):
+        print(f'{kind}\t{sim:.2f}\t{key}\t{other}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Persona stats - online per-persona preference counters for live study monitoring
+
+The app updates one PersonaStats object per process as the study runs:
+- record_shown       -- summariseData, once the (counterbalanced) persona order is drawn
+- record_thumbs      -- collectFeedback, for every 👍 / 👎 on a scenario column
+- record_selection   -- click_selection_yes, with the slider judgment of the picked scenario
+
+Every counter is kept per persona and per (persona, display position). Updates are O(1) under a lock;
+a background thread rebuilds the summary at most every `snapshot_interval` seconds and writes it to
+`<snapshot_dir>/<instance>.json` (atomic replace), so the monitoring page (monitor_app.py) only ever
+reads small precomputed files and never touches the database.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+
+PERSONAS = ['formal', 'youngsib', 'friend']
+POSITIONS = [1, 2, 3]
+
+# options of the 'Judge_scenario' slider in scenario_selection
+SLIDER_OPTIONS = ["Not really ", "Needs some edits", "Pretty good but I'd like to tweak it", "Ready as is!"]
+
+
+def _empty_counts():
+    return {
+        'shown': 0,
+        'rated': 0,
+        'thumbs_up': 0,
+        'selected': 0,
+        'slider': {option: 0 for option in SLIDER_OPTIONS},
+    }
+
+
+class PersonaStats:
+    """Thread-safe incremental counters with cheap periodic snapshots.
+
+    Parameters:
+    snapshot_dir (str): directory the snapshot json is written to
+    instance (str): name of this process / worker -- restarting with the same name continues its counts
+    snapshot_interval (float): seconds between snapshot writes (only if something changed)
+    """
+
+    def __init__(self, snapshot_dir, instance=None, snapshot_interval=10):
+        self.snapshot_dir = snapshot_dir
+        self.instance = instance or socket.gethostname()
+        self.snapshot_interval = snapshot_interval
+        self.path = os.path.join(snapshot_dir, f'{self.instance}.json')
+
+        self.lock = threading.Lock()
+        self.counts = defaultdict(_empty_counts)    # key: persona or 'persona@position'
+        self.sessions = 0
+        self.dirty = False
+        self.latest = {}
+
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self._load()
+        self.latest = self._build_snapshot()
+
+        self.thread = threading.Thread(target=self._run, name='persona-stats', daemon=True)
+        self.thread.start()
+
+    ## --- updates (called from the streamlit callbacks) ---
+
+    def record_shown(self, persona_order):
+        """Counts one review page showing the personas in the given display order."""
+        with self.lock:
+            self.sessions += 1
+            for position, persona in enumerate(persona_order, start=1):
+                for key in (persona, f'{persona}@{position}'):
+                    self.counts[key]['shown'] += 1
+            self.dirty = True
+
+    def record_thumbs(self, persona, position, score):
+        """Counts one thumbs rating (score 1 for 👍, 0 for 👎) of a scenario column."""
+        with self.lock:
+            for key in (persona, f'{persona}@{position}'):
+                self.counts[key]['rated'] += 1
+                self.counts[key]['thumbs_up'] += int(score >= 1)
+            self.dirty = True
+
+    def record_selection(self, persona, position, judgment):
+        """Counts the final pick of a scenario column together with its slider judgment."""
+        with self.lock:
+            for key in (persona, f'{persona}@{position}'):
+                self.counts[key]['selected'] += 1
+                if judgment in self.counts[key]['slider']:
+                    self.counts[key]['slider'][judgment] += 1
+            self.dirty = True
+
+    ## --- reads ---
+
+    def snapshot(self):
+        """Returns the latest precomputed summary (no work is done on read)."""
+        return self.latest
+
+    def _build_snapshot(self):
+        with self.lock:
+            counts = {key: dict(value, slider=dict(value['slider'])) for key, value in self.counts.items()}
+            sessions = self.sessions
+            self.dirty = False
+
+        return {
+            'instance': self.instance,
+            'updated': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'sessions': sessions,
+            'counts': counts,
+        }
+
+    def _load(self):
+        """Continues from our own last snapshot, so a restart does not reset the counters."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.sessions = previous.get('sessions', 0)
+        for key, value in previous.get('counts', {}).items():
+            counts = _empty_counts()
+            counts.update({k: v for k, v in value.items() if k != 'slider'})
+            counts['slider'].update(value.get('slider', {}))
+            self.counts[key] = counts
+
+    def _write(self, snapshot):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            if not self.dirty:
+                continue
+            try:
+                self.latest = self._build_snapshot()
+                self._write(self.latest)
+            except Exception as e:
+                print(f"persona stats: could not write snapshot: {e}")
+
+
+def rates(counts):
+    """Derived rates for one counter entry (thumbs-up rate among rated, selection rate among shown)."""
+    return {
+        'thumbs_up_rate': counts['thumbs_up'] / counts['rated'] if counts['rated'] else None,
+        'selection_rate': counts['selected'] / counts['shown'] if counts['shown'] else None,
+    }
+
+
+def merge_snapshots(snapshot_dir):
+    """Sums the snapshots of all instances in a directory (used by the monitoring page)."""
+    merged = defaultdict(_empty_counts)
+    sessions = 0
+    instances = []
+
+    for name in sorted(os.listdir(snapshot_dir)) if os.path.isdir(snapshot_dir) else []:
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(snapshot_dir, name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        instances.append((snapshot.get('instance', name), snapshot.get('updated')))
+        sessions += snapshot.get('sessions', 0)
+        for key, value in snapshot.get('counts', {}).items():
+            for field in ('shown', 'rated', 'thumbs_up', 'selected'):
+                merged[key][field] += value.get(field, 0)
+            for option, n in value.get('slider', {}).items():
+                merged[key]['slider'][option] = merged[key]['slider'].get(option, 0) + n
+
+    return {'sessions': sessions, 'instances': instances, 'counts': dict(merged)}
@@ -0,0 +1,144 @@
+"""
+Participant index - fast check whether a Prolific ID has already completed the study
+
+The consent gate asks CompletedParticipants whether the session's `pid` is known before any model call is made.
+The answer comes from an in-memory Bloom filter of all completed pids:
+- a miss means the pid has certainly not completed -- no database round-trip (the case for almost everyone)
+- a hit is confirmed with a point lookup on the session table (`query` on the chat_id key), as the filter has false positives
+
+The filter is filled by a background scan of the table that only fetches the chat_id attribute, and every
+session written by finaliseScenario is added straight away. Until the scan has finished the filter is incomplete,
+so during that window every check falls back to the point lookup.
+"""
+
+import hashlib
+import math
+import threading
+
+from boto3.dynamodb.conditions import Key
+
+
+# the placeholder pid used when the Prolific ID is missing (see make_chat_id) -- never treated as a repeat
+ANONYMOUS_PIDS = {'00000'}
+
+
+class BloomFilter:
+    """Plain bit-array Bloom filter with double hashing.
+
+    Parameters:
+    capacity (int): expected number of items
+    error_rate (float): false positive rate at that capacity
+    """
+
+    def __init__(self, capacity=200000, error_rate=0.001):
+        self.n_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return ((h1 + i * h2) % self.n_bits for i in range(self.n_hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class CompletedParticipants:
+    """Process-wide index of completed pids, loaded in the background from the session table.
+
+    Parameters:
+    make_table (callable): returns a new boto3 Table of the session table (boto3 resources are not thread safe)
+    capacity / error_rate: sizing of the Bloom filter
+    page_size (int): items per page of the loading scan
+    """
+
+    def __init__(self, make_table, capacity=200000, error_rate=0.001, page_size=1000):
+        self.make_table = make_table
+        self.page_size = page_size
+        self.filter = BloomFilter(capacity, error_rate)
+        self.confirmed = set()
+        self.lock = threading.Lock()
+        self.lookup_lock = threading.Lock()
+        self.lookup_table = None
+        self.loaded = threading.Event()
+        self.counts = {'checks': 0, 'filter_hits': 0, 'lookups': 0, 'repeats': 0}
+
+    def load_async(self):
+        threading.Thread(target=self._load, name='pid-index-load', daemon=True).start()
+        return self
+
+    def _load(self):
+        table = self.make_table()
+        scan_kwargs = {'ProjectionExpression': 'chat_id', 'Limit': self.page_size}
+        n = 0
+        try:
+            while True:
+                page = table.scan(**scan_kwargs)
+                with self.lock:
+                    for item in page.get('Items', []):
+                        if item.get('chat_id'):
+                            self.filter.add(str(item['chat_id']))
+                            n += 1
+                if 'LastEvaluatedKey' not in page:
+                    break
+                scan_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+        except Exception as e:
+            # the index stays incomplete -- checks keep using the point lookup
+            print(f"could not load the participant index: {e}")
+            return
+        print(f"participant index loaded ({n} sessions)")
+        self.loaded.set()
+
+    def add(self, pid):
+        """Marks a pid as completed (called once its session has been written)."""
+        if pid in ANONYMOUS_PIDS:
+            return
+        with self.lock:
+            self.filter.add(pid)
+            self.confirmed.add(pid)
+
+    def has_completed(self, pid):
+        """True if the pid has already completed the study. Errors of the lookup count as 'not completed'."""
+        if not pid or pid in ANONYMOUS_PIDS:
+            return False
+        with self.lock:
+            self.counts['checks'] += 1
+            if pid in self.confirmed:
+                self.counts['repeats'] += 1
+                return True
+            if self.loaded.is_set() and pid not in self.filter:
+                return False
+            self.counts['filter_hits'] += 1
+
+        found = self._lookup(pid)
+        if found:
+            with self.lock:
+                self.confirmed.add(pid)
+                self.counts['repeats'] += 1
+        return found
+
+    def _lookup(self, pid):
+        with self.lookup_lock:
+            self.counts['lookups'] += 1
+            try:
+                if self.lookup_table is None:
+                    self.lookup_table = self.make_table()
+                response = self.lookup_table.query(
+                    KeyConditionExpression=Key('chat_id').eq(pid),
+                    ProjectionExpression='chat_id',
+                    Limit=1,
+                )
+            except Exception as e:
+                print(f"participant lookup failed for {pid}: {e}")
+                return False
+        return bool(response.get('Items'))
+
+    def status(self):
+        with self.lock:
+            return {**self.counts, 'loaded': self.loaded.is_set(), 'confirmed': len(self.confirmed)}
@@ -0,0 +1,121 @@
+"""
+PII redaction - cheap local scrubbing of identifying details before model calls and storage
+
+Participants are asked not to share identifying information; this is the safety net. Every human turn is
+passed through a Redactor before it reaches the interview model (and so the memory, the extraction prompt and
+the scenario prompts), and the final package is scrubbed again before it is stored.
+
+All patterns are compiled into one regular expression with a named group per kind, so a turn is scanned
+in a single pass (a few microseconds for a typical message). Names are found by looking every word up
+(case-insensitively -- "my friend sarah" counts too) in a gazetteer set, which keeps the cost independent of
+the gazetteer size. Names that are also ordinary words ('jack', 'lily', 'max', ...) are only redacted when
+they are capitalised, so everyday lowercase text isn't scrubbed.
+
+Matches are replaced by a placeholder such as [EMAIL]; the number of replacements per kind is returned
+so it can be stored with the session.
+"""
+
+import re
+from collections import Counter
+
+
+# common first names -- extend with a one-name-per-line file (`pii_names_file` secret).
+# Names that are also ordinary words ('Will', 'May', 'Grace', ...) are left out on purpose.
+DEFAULT_NAMES = """
+Aaron Abigail Adam Aidan Aisha Alex Alexander Alice Amelia Amy Andrew Anna Ava Ben Benjamin Bethany Caleb
+Callum Charlie Charlotte Chloe Chris Christopher Connor Daniel David Dylan Eleanor Eli Elijah Elizabeth Ella
+Ellie Emily Emma Ethan Evie Finn Freya Gabriel George Georgia Hannah Harry Harvey Isaac Isabella Isla Jack
+Jacob James Jasmine Jayden Jessica Joe Joel John Jonathan Joseph Joshua Kai Katie Kieran Leah Leo Liam Lily
+Logan Lucas Lucy Luke Madison Maisie Maria Mason Matthew Max Megan Mia Michael Mohammed Muhammad Nathan Noah
+Oliver Olivia Oscar Owen Poppy Rachel Rebecca Reuben Riley Rosie Ryan Samuel Sarah Scarlett Sebastian Sophia
+Sophie Thomas Tom Tyler William Zach Zara Zoe
+""".split()
+
+PLACEHOLDERS = {
+    'email': '[EMAIL]',
+    'url': '[URL]',
+    'handle': '[HANDLE]',
+    'phone': '[PHONE]',
+    'name': '[NAME]',
+}
+
+## one alternative per kind -- order matters where they overlap (an email must win over the @handle inside it)
+_PATTERNS = [
+    ('email', r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"),
+    ('url', r"(?:https?://|www\.)\S*[^\s.,;:!?)\]]"),
+    ('handle', r"(?<![\w@])@\w{2,}"),
+    ('phone', r"(?<![\w+])\+?\d[\d ()./-]{6,}\d(?!\w)"),
+    ('name', r"\b[A-Za-z]+(?:'s)?\b"),
+]
+
+PII_PATTERN = re.compile('|'.join(f'(?P<{kind}>{pattern})' for kind, pattern in _PATTERNS))
+
+# free-text fields of the scenario package (see finaliseScenario) -- ids, timestamps and persona names are left alone
+PACKAGE_TEXT_FIELDS = ['scenario', 'answer set', 'scenarios_all', 'chat_history', 'adaptation_list', 'scenario_candidates']
+
+# gazetteer names that are also common words -- lowercase occurrences of these are left alone
+COMMON_WORDS = frozenset("""
+amber april art autumn bill chase daisy dawn dean don drew faith frank georgia grace guy harry holly hope
+hunter iris ivy jack jasmine jay joy june lane lily madison mark mason max may miles penny poppy rain ray
+reed rich rob rose ruby sandy sky summer sue wade will
+""".split())
+
+# a phone number needs at least this many digits (so dates and years are left alone)
+MIN_PHONE_DIGITS = 9
+
+
+def load_names(path):
+    """Reads a gazetteer file with one name per line (lines starting with # are ignored)."""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+class Redactor:
+    """Single-pass redaction of emails, URLs, @handles, phone numbers and gazetteer names.
+
+    Parameters:
+    names (iterable): extra names to redact on top of DEFAULT_NAMES
+    """
+
+    def __init__(self, names=()):
+        self.names = frozenset(n.strip().lower() for n in list(DEFAULT_NAMES) + list(names))
+
+    def redact(self, text):
+        """Returns the redacted text and a Counter of replacements per kind."""
+        counts = Counter()
+        if not text:
+            return text, counts
+
+        def replace(match):
+            kind = match.lastgroup
+            value = match.group()
+            if kind == 'phone' and sum(c.isdigit() for c in value) < MIN_PHONE_DIGITS:
+                return value
+            if kind == 'name':
+                possessive = value.endswith("'s")
+                word = value[:-2] if possessive else value
+                if word.lower() not in self.names or (word.islower() and word in COMMON_WORDS):
+                    return value
+                counts[kind] += 1
+                return PLACEHOLDERS[kind] + ("'s" if possessive else '')
+            counts[kind] += 1
+            return PLACEHOLDERS[kind]
+
+        return PII_PATTERN.sub(replace, text), counts
+
+    def redact_item(self, item, counts=None):
+        """Redacts every string in a (nested) dict / list / tuple, e.g. the final scenario package.
+
+        Returns:
+        (redacted copy of item, Counter of replacements per kind)
+        """
+        counts = Counter() if counts is None else counts
+        if isinstance(item, str):
+            text, found = self.redact(item)
+            counts.update(found)
+            return text, counts
+        if isinstance(item, dict):
+            return {k: self.redact_item(v, counts)[0] for k, v in item.items()}, counts
+        if isinstance(item, (list, tuple)):
+            return type(item)(self.redact_item(v, counts)[0] for v in item), counts
+        return item, counts
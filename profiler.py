@@ -0,0 +1,145 @@
+"""
+Rerun profiler - opt-in sampling profiler + tracemalloc around a streamlit rerun
+
+Enabled per session with the `?profile=1` query parameter, or for every session with the PROFILE_RERUNS
+environment variable (see interaction_prototype.py). When it is off, stateAgent is called directly -- nothing
+of this module runs.
+
+While a profiled rerun runs, a sampler thread records the stack of the script thread every `interval` seconds
+(including the streamlit frames above stateAgent, so widget building and rerun overhead show up), and
+tracemalloc traces allocations. Each rerun writes, to `out_dir`:
+- <name>.collapsed : folded stacks ("frame;frame;frame count") -- open in speedscope or render with flamegraph.pl
+- <name>.alloc.txt : peak traced memory and the top allocation sites by size growth
+where <name> is "<time>-<chat_id>-<agentState before>-<agentState after>". Only the newest `max_profiles`
+reruns are kept.
+
+Only one rerun per process is profiled at a time (tracemalloc is process-wide); reruns of other sessions
+that start meanwhile just run unprofiled.
+"""
+
+import glob
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# keep folded stacks readable -- only the innermost frames
+MAX_DEPTH = 80
+
+_UNSAFE = re.compile(r'[^\w.-]+')
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def collapse(frame):
+    """Folded stack of a frame, outermost first."""
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class RerunProfiler:
+    """Writes folded-stack and allocation profiles of single reruns.
+
+    Parameters:
+    out_dir (str): where the profiles are written
+    interval (float): seconds between stack samples
+    max_profiles (int): number of profiled reruns kept (older ones are deleted)
+    top_allocations (int): number of allocation sites listed per rerun
+    """
+
+    def __init__(self, out_dir='profiles', interval=0.005, max_profiles=200, top_allocations=40):
+        self.out_dir = out_dir
+        self.interval = interval
+        self.max_profiles = max_profiles
+        self.top_allocations = top_allocations
+        self.busy = threading.Lock()
+        os.makedirs(out_dir, exist_ok=True)
+
+    @contextmanager
+    def profile(self, chat_id, state):
+        """Profiles the enclosed block.
+
+        Parameters:
+        chat_id (str): session tag
+        state (callable): returns the current agentState -- called before and after the block
+        """
+        if not self.busy.acquire(blocking=False):
+            yield
+            return
+
+        target = threading.get_ident()
+        state_before = state()
+        samples = Counter()
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(self.interval):
+                frame = sys._current_frames().get(target)
+                if frame is not None:
+                    samples[collapse(frame)] += 1
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        sampler = threading.Thread(target=sample, name='rerun-profiler', daemon=True)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            # streamlit's st.rerun() / st.stop() end the block with an exception -- the profile is still written
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+            seconds = time.perf_counter() - start
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            try:
+                self._write(chat_id, state_before, state(), seconds, samples, before, after, peak)
+            finally:
+                self.busy.release()
+
+    def _write(self, chat_id, state_before, state_after, seconds, samples, before, after, peak):
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        name = _UNSAFE.sub('_', f"{stamp}-{chat_id}-{state_before}-{state_after}")
+        path = os.path.join(self.out_dir, name)
+
+        with open(path + '.collapsed', 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        # the profiler's own snapshots are not of interest
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        growth = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'traceback')
+        with open(path + '.alloc.txt', 'w') as f:
+            f.write(f"chat_id: {chat_id}\nagentState: {state_before} -> {state_after}\n")
+            f.write(f"wall time: {seconds:.3f}s, samples: {sum(samples.values())}, peak traced memory: {peak / 2**20:.1f} MB\n\n")
+            for stat in growth[:self.top_allocations]:
+                f.write(f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blocks)\n")
+                for line in stat.traceback.format()[-6:]:
+                    f.write(f"    {line}\n")
+
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        profiles = sorted(glob.glob(os.path.join(self.out_dir, '*.collapsed')))
+        for old in profiles[:max(0, len(profiles) - self.max_profiles)]:
+            base = old[:-len('.collapsed')]
+            for path in (old, base + '.alloc.txt'):
+                if os.path.exists(path):
+                    os.remove(path)
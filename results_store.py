@@ -0,0 +1,174 @@
+"""
+Local results store - append-only, date-partitioned Parquet dataset of completed sessions
+
+Every completed scenario package is handed to the store next to the DynamoDB `table.put_item` call
+in finaliseScenario. The hand-over is only a queue put -- a background thread flattens the packages
+(see session_records.py), buffers them and writes them as Parquet row groups, rolling over to a new
+file every `rows_per_file` rows (or `max_file_age` seconds) so there is no file-per-session overhead.
+
+Files that are still being written are prefixed with '_' and renamed once closed, which means
+pyarrow.dataset (and the query helpers below) only ever see complete files.
+
+Layout:
+    <root>/date=YYYY-MM-DD/sessions-<process>-<n>.parquet
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from session_records import SESSION_SCHEMA, N_COLUMNS, flatten_package, rows_to_table
+
+
+class ResultsStore:
+    """Buffered, append-only Parquet writer running on its own thread.
+
+    Parameters:
+    root (str): directory of the dataset
+    row_group_size (int): number of sessions buffered before a row group is written
+    rows_per_file (int): a file is closed (and becomes visible to readers) after this many rows
+    max_file_age (float): seconds after which a buffered row group / open file is flushed and closed anyway
+    """
+
+    def __init__(self, root, row_group_size=256, rows_per_file=8192, max_file_age=300):
+        self.root = root
+        self.row_group_size = row_group_size
+        self.rows_per_file = rows_per_file
+        self.max_file_age = max_file_age
+
+        self.file_schema = SESSION_SCHEMA.remove(SESSION_SCHEMA.get_field_index('date'))
+        self.queue = queue.Queue()
+        self.buffers = {}       # date -> list of rows not yet written
+        self.writers = {}       # date -> [ParquetWriter, temp path, final path, rows written]
+        self.file_counter = 0
+        self.last_flush = time.monotonic()
+
+        os.makedirs(root, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name='results-store', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def append(self, package):
+        """Queues a completed scenario package for writing -- returns immediately."""
+        self.queue.put(dict(package))
+
+    def close(self):
+        """Flushes all buffered rows and closes open files (called automatically at exit)."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                package = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                package = False
+
+            if package is None:
+                self._flush(close_files=True)
+                return
+
+            if package:
+                try:
+                    row = flatten_package(package)
+                except Exception as e:
+                    # a malformed package must never take down the writer thread
+                    print(f"results store: could not flatten package for {package.get('chat_id')}: {e}")
+                else:
+                    buffer = self.buffers.setdefault(row['date'], [])
+                    buffer.append(row)
+                    if len(buffer) >= self.row_group_size:
+                        self._write_row_group(row['date'])
+
+            if time.monotonic() - self.last_flush > self.max_file_age:
+                self._flush(close_files=True)
+
+    def _write_row_group(self, date):
+        rows = self.buffers.pop(date, [])
+        if not rows:
+            return
+
+        if date not in self.writers:
+            part_dir = os.path.join(self.root, f'date={date}')
+            os.makedirs(part_dir, exist_ok=True)
+            self.file_counter += 1
+            name = f'sessions-{os.getpid()}-{int(time.time())}-{self.file_counter}.parquet'
+            temp_path = os.path.join(part_dir, '_' + name)
+            writer = pq.ParquetWriter(temp_path, self.file_schema, compression='zstd')
+            self.writers[date] = [writer, temp_path, os.path.join(part_dir, name), 0]
+
+        entry = self.writers[date]
+        entry[0].write_table(rows_to_table(rows).drop_columns(['date']))
+        entry[3] += len(rows)
+
+        if entry[3] >= self.rows_per_file:
+            self._close_file(date)
+
+    def _close_file(self, date):
+        writer, temp_path, final_path, _ = self.writers.pop(date)
+        writer.close()
+        os.replace(temp_path, final_path)
+
+    def _flush(self, close_files):
+        for date in list(self.buffers):
+            self._write_row_group(date)
+        if close_files:
+            for date in list(self.writers):
+                self._close_file(date)
+        self.last_flush = time.monotonic()
+
+
+def open_dataset(root):
+    """Opens the store (or an export from export_sessions.py -- same layout) as a pyarrow dataset."""
+    return ds.dataset(root, format='parquet', partitioning='hive', schema=SESSION_SCHEMA)
+
+
+def read_sessions(root, columns, since=None, until=None):
+    """Reads only the requested columns, pruning date partitions outside [since, until].
+
+    Parameters:
+    root (str): dataset directory
+    columns (list): columns to load
+    since / until (str): inclusive YYYY-MM-DD bounds (optional)
+    """
+    dataset = open_dataset(root)
+    date_filter = None
+    if since is not None:
+        date_filter = ds.field('date') >= since
+    if until is not None:
+        until_filter = ds.field('date') <= until
+        date_filter = until_filter if date_filter is None else date_filter & until_filter
+    return dataset.to_table(columns=columns, filter=date_filter)
+
+
+def thumbs_up_rate_per_persona(root, days=7):
+    """Thumbs-up rate per persona over the last `days` days, reading only persona and thumbs columns.
+
+    Returns:
+    dict persona -> {'rated': number of rated scenarios, 'thumbs_up': number of 👍, 'rate': share of 👍}
+    """
+    since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    columns = [f'persona_{i}' for i in range(1, N_COLUMNS + 1)] + [f'thumbs_{i}' for i in range(1, N_COLUMNS + 1)]
+    table = read_sessions(root, columns, since=since)
+
+    ## stack the three (persona, thumbs) column pairs into one long pair of arrays
+    personas = pa.chunked_array([chunk for i in range(1, N_COLUMNS + 1) for chunk in table[f'persona_{i}'].chunks], type=pa.string())
+    thumbs = pa.chunked_array([chunk for i in range(1, N_COLUMNS + 1) for chunk in table[f'thumbs_{i}'].chunks], type=pa.float32())
+    long = pa.table({'persona': personas, 'thumbs': thumbs}).filter(pc.is_valid(thumbs))
+
+    grouped = long.group_by('persona').aggregate([('thumbs', 'count'), ('thumbs', 'sum')])
+    result = {}
+    for persona, rated, ups in zip(grouped['persona'].to_pylist(), grouped['thumbs_count'].to_pylist(), grouped['thumbs_sum'].to_pylist()):
+        if persona is None:
+            continue
+        result[persona] = {'rated': rated, 'thumbs_up': int(ups), 'rate': ups / rated if rated else None}
+    return result
@@ -0,0 +1,195 @@
+"""
+Scenario ranking - N candidates per persona, ranked by a cheap local scorer
+
+summariseData can ask for several scenario candidates per persona (`scenario_candidates` secret, default 1).
+All candidates are generated concurrently on a bounded, context-aware thread pool (so they stay attached to
+the traced run), scored locally and only the best one per persona is shown:
+- length: 1 inside LENGTH_RANGE words, falling off outside it
+- overlap: share of the content words of the extracted answer_set that made it into the scenario
+- duplicate: highest character-shingle Jaccard similarity to the candidates of the other personas (a penalty --
+  the three columns should read differently)
+
+To keep the wall-clock time of today's flow, a persona does not wait for all of its candidates: once its first
+candidate has arrived, the others get `grace` seconds, then the best one available is shown. Candidates that
+arrive later are still scored and logged. Every candidate ends up in the candidate log, which is stored with
+the package ('scenario_candidates') for analysis.
+"""
+
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from decimal import Decimal
+
+import numpy as np
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+from near_duplicates import shingle_hashes
+
+
+# the example scenarios in lc_prompts.py are ~100 words long
+LENGTH_RANGE = (60, 180)
+
+WEIGHTS = {'length': 1.0, 'overlap': 1.0, 'duplicate': 1.0}
+
+_WORD = re.compile(r"[a-z']+")
+# content words only -- short function words would inflate the overlap of any text
+MIN_WORD_LENGTH = 4
+
+
+def content_words(text):
+    return {w for w in _WORD.findall(str(text).lower()) if len(w) >= MIN_WORD_LENGTH}
+
+
+def jaccard(a, b):
+    if len(a) == 0 or len(b) == 0:
+        return 0.0
+    common = len(np.intersect1d(a, b, assume_unique=True))
+    return common / (len(a) + len(b) - common)
+
+
+class ScenarioScorer:
+    """Scores scenario texts against one session's extracted answers.
+
+    Parameters:
+    answer_set (dict): the extracted answers (a string in testing runs)
+    """
+
+    def __init__(self, answer_set):
+        values = answer_set.values() if isinstance(answer_set, dict) else [answer_set]
+        self.answer_words = set().union(*(content_words(v) for v in values if v))
+        self.shingles = {}
+
+    def _shingles(self, text):
+        if text not in self.shingles:
+            self.shingles[text] = shingle_hashes(text)
+        return self.shingles[text]
+
+    def score(self, text, others=()):
+        """Returns the score components and the weighted total of one candidate.
+
+        others (iterable): texts it should not duplicate (the other personas' candidates)
+        """
+        n_words = len(str(text).split())
+        low, high = LENGTH_RANGE
+        length = 1.0 if low <= n_words <= high else min(n_words / low, high / max(n_words, 1))
+
+        words = content_words(text)
+        overlap = len(words & self.answer_words) / len(self.answer_words) if self.answer_words else 0.0
+
+        shingles = self._shingles(text)
+        duplicate = max((jaccard(shingles, self._shingles(other)) for other in others), default=0.0)
+
+        total = WEIGHTS['length'] * length + WEIGHTS['overlap'] * overlap - WEIGHTS['duplicate'] * duplicate
+        return {'length': length, 'overlap': overlap, 'duplicate': duplicate, 'score': total}
+
+
+def generate_ranked(generate, persona_inputs, scorer, on_shown, n_candidates=1, max_concurrency=3, grace=2.0, log=None):
+    """Generates n_candidates per persona concurrently and shows the best candidate of each persona.
+
+    Parameters:
+    generate (callable): inputs -> response dict with an 'output_scenario' entry (e.g. chain.invoke)
+    persona_inputs (list): one inputs dict per persona / column
+    scorer (ScenarioScorer): ranks the candidates
+    on_shown (callable): called as on_shown(position, response) from the calling thread once a persona's pick is made
+    n_candidates (int): candidates per persona
+    max_concurrency (int): max model calls in flight
+    grace (float): seconds a persona waits for its remaining candidates after the first one arrived
+    log (list): candidate records are appended here (also the late ones, from the worker threads)
+
+    Returns:
+    list with the shown response per persona
+    """
+    log = [] if log is None else log
+    started = time.perf_counter()
+
+    def timed(inputs):
+        start = time.perf_counter()
+        return generate(inputs), time.perf_counter() - start
+
+    pool = ContextThreadPoolExecutor(max_workers=max_concurrency)
+    futures = {}
+    # round-robin over personas, so with a small pool every persona gets its first candidate early
+    for candidate in range(n_candidates):
+        for position, inputs in enumerate(persona_inputs):
+            futures[pool.submit(timed, inputs)] = (position, candidate)
+
+    results = {position: [] for position in range(len(persona_inputs))}
+    first_arrival = {}
+    shown = {}
+
+    def record(future, shown_flag=False):
+        position, candidate = futures[future]
+        try:
+            response, seconds = future.result()
+            text = response['output_scenario']
+        except Exception as e:
+            response, seconds, text = None, None, None
+            print(f"scenario candidate {candidate} for column {position + 1} failed: {e}")
+        entry = {'position': position + 1, 'candidate': candidate, 'scenario': text, 'seconds': seconds, 'shown': shown_flag}
+        return response, entry
+
+    def log_late(future):
+        # candidates arriving after their persona's pick are only scored and logged
+        try:
+            response, entry = record(future)
+        except BaseException:
+            # e.g. calls cancelled because the session disconnected (see cancellation.py) -- nothing to log
+            return
+        if response is not None:
+            others = [r['output_scenario'] for p, r in shown.items() if p != entry['position'] - 1]
+            entry.update(scorer.score(entry['scenario'], others))
+        log.append(entry)
+
+    pending = set(futures)
+    try:
+        while len(shown) < len(persona_inputs):
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            now = time.perf_counter()
+            for future in done:
+                if futures[future][0] in shown:
+                    log_late(future)
+                    continue
+                response, entry = record(future)
+                results[entry['position'] - 1].append((response, entry))
+                first_arrival.setdefault(entry['position'] - 1, now)
+
+            for position in results:
+                if position in shown:
+                    continue
+                persona_done = len(results[position]) == n_candidates
+                ready = [(r, e) for r, e in results[position] if r is not None]
+                if persona_done and not ready:
+                    raise RuntimeError(f"no scenario could be generated for column {position + 1}")
+                if not ready or not (persona_done or now - first_arrival[position] >= grace):
+                    continue
+
+                ## rank against everything the other personas have produced so far
+                others = [r['output_scenario'] for p, candidates in results.items() if p != position for r, _ in candidates if r is not None]
+                for response, entry in ready:
+                    entry.update(scorer.score(entry['scenario'], others))
+                best_response, best_entry = max(ready, key=lambda pair: pair[1]['score'])
+                best_entry['shown'] = True
+                shown[position] = best_response
+                log.extend(entry for _, entry in results[position])
+                on_shown(position, best_response)
+    finally:
+        for future in pending:
+            future.add_done_callback(log_late)
+        # don't wait for stragglers -- they only end up in the log
+        pool.shutdown(wait=False)
+
+    print(f"scenario candidates: {len(futures)} requested, picks shown after {time.perf_counter() - started:.1f}s")
+    return [shown[position] for position in range(len(persona_inputs))]
+
+
+def log_to_item(log, personas):
+    """Candidate log in a DynamoDB-friendly form (no floats), with the persona of each column filled in."""
+    def plain(value):
+        return Decimal(str(round(value, 4))) if isinstance(value, float) else value
+
+    items = []
+    for entry in list(log):
+        item = {k: plain(v) for k, v in entry.items()}
+        item['persona'] = personas[entry['position'] - 1] if len(personas) >= entry['position'] else None
+        items.append(item)
+    return items
@@ -0,0 +1,175 @@
+"""
+Session records - flattening of stored scenario packages
+
+The app stores one `scenario_package` per completed session (see finaliseScenario in interaction_prototype.py).
+This module turns those nested packages into flat, typed rows so they can be written to columnar
+formats (Parquet via pyarrow) and analysed without deserialising whole items.
+"""
+
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pyarrow as pa
+
+
+# same mapping that collectFeedback uses for the streamlit_feedback widget
+SCORE_MAPPINGS = {
+    "thumbs": {"👍": 1, "👎": 0},
+    "faces": {"😀": 1, "🙂": 0.75, "😐": 0.5, "🙁": 0.25, "😞": 0},
+}
+
+# the four slots extracted from the interview (see extraction_prompt in lc_prompts.py)
+ANSWER_SLOTS = ['what', 'context', 'outcome', 'reaction']
+
+# the number of scenario columns shown on the review page
+N_COLUMNS = 3
+
+## one row per completed session -- the `date` partition column is derived from the session timestamp
+SESSION_SCHEMA = pa.schema(
+    [
+        ('chat_id', pa.string()),
+        ('timestamp', pa.string()),
+        ('date', pa.string()),
+        ('final_scenario', pa.string()),
+        ('judgment', pa.string()),
+        ('selected_column', pa.int8()),
+        ('example_id', pa.string()),
+        ('interview_mode', pa.string()),
+    ]
+    + [(f'answer_{slot}', pa.string()) for slot in ANSWER_SLOTS]
+    + [('answer_raw', pa.string())]
+    + [(f'scenario_{i}', pa.string()) for i in range(1, N_COLUMNS + 1)]
+    + [(f'persona_{i}', pa.string()) for i in range(1, N_COLUMNS + 1)]
+    + [(f'thumbs_{i}', pa.float32()) for i in range(1, N_COLUMNS + 1)]
+    + [(f'feedback_text_{i}', pa.string()) for i in range(1, N_COLUMNS + 1)]
+    + [
+        ('n_adaptations', pa.int32()),
+        ('adaptation_list', pa.list_(pa.struct([('request', pa.string()), ('response', pa.string())]))),
+        ('chat_history', pa.list_(pa.struct([('role', pa.string()), ('content', pa.string())]))),
+        ('near_duplicate_answers', pa.list_(pa.string())),
+        ('near_duplicate_scenarios', pa.list_(pa.string())),
+        ('total_tokens', pa.int64()),
+        ('cost_usd', pa.float64()),
+        ('pii_redactions', pa.int32()),
+        ('cancelled_stages', pa.list_(pa.string())),
+        ('scenario_candidates', pa.list_(pa.struct([
+            ('persona', pa.string()),
+            ('position', pa.int8()),
+            ('candidate', pa.int16()),
+            ('scenario', pa.string()),
+            ('seconds', pa.float32()),
+            ('length', pa.float32()),
+            ('overlap', pa.float32()),
+            ('duplicate', pa.float32()),
+            ('score', pa.float32()),
+            ('shown', pa.bool_()),
+        ]))),
+    ]
+)
+
+
+def to_plain(value):
+    """Converts DynamoDB types (Decimal, sets) into plain python values, recursively."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {k: to_plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [to_plain(v) for v in value]
+    return value
+
+
+def session_date(timestamp):
+    """Returns the YYYY-MM-DD partition value for a session timestamp (as set in st.session_state['timestamp'])."""
+    try:
+        return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        return "unknown"
+
+
+def feedback_score(fb):
+    """Maps a stored streamlit_feedback answer onto a numeric score (None if no feedback was given)."""
+    if not isinstance(fb, dict):
+        return None
+    return SCORE_MAPPINGS.get(fb.get('type'), {}).get(fb.get('score'))
+
+
+def flatten_package(package):
+    """Flattens one stored scenario package into a row matching SESSION_SCHEMA.
+
+    Parameters:
+    package (dict): the item as stored by finaliseScenario (either straight from session state or read back from DynamoDB)
+
+    Returns:
+    dict with one key per SESSION_SCHEMA column
+    """
+    package = to_plain(package)
+    scenarios_all = package.get('scenarios_all') or {}
+    answer_set = package.get('answer set')
+    personas = package.get('personas') or []
+
+    row = {
+        'chat_id': package.get('chat_id'),
+        'timestamp': package.get('timestamp'),
+        'date': session_date(package.get('timestamp')),
+        'final_scenario': package.get('scenario'),
+        'judgment': package.get('judgment'),
+        'selected_column': int(package['selected_column']) if package.get('selected_column') else None,
+        'example_id': package.get('example_id'),
+        'interview_mode': package.get('interview_mode'),
+    }
+
+    ## the answer set is a dict when extraction worked, but a string in testing runs
+    for slot in ANSWER_SLOTS:
+        value = answer_set.get(slot) if isinstance(answer_set, dict) else None
+        row[f'answer_{slot}'] = None if value is None else str(value)
+    row['answer_raw'] = json.dumps(answer_set, ensure_ascii=False, default=str)
+
+    for i in range(1, N_COLUMNS + 1):
+        fb = scenarios_all.get(f'fb{i}')
+        row[f'scenario_{i}'] = scenarios_all.get(f'col{i}')
+        row[f'persona_{i}'] = personas[i - 1] if len(personas) >= i else None
+        row[f'thumbs_{i}'] = feedback_score(fb)
+        row[f'feedback_text_{i}'] = fb.get('text') if isinstance(fb, dict) else None
+
+    adaptations = package.get('adaptation_list') or []
+    row['n_adaptations'] = len(adaptations)
+    row['adaptation_list'] = [
+        {'request': str(step[0]), 'response': str(step[1])} for step in adaptations if len(step) == 2
+    ]
+
+    ## chat history is stored as (type, content) pairs
+    history = package.get('chat_history') or []
+    row['chat_history'] = [
+        {'role': str(turn[0]), 'content': str(turn[1])} for turn in history if isinstance(turn, (list, tuple))
+    ]
+
+    ## set at finalise time by near_duplicates.check_package (not present in older sessions)
+    near_duplicates = package.get('near_duplicates') or {}
+    row['near_duplicate_answers'] = near_duplicates.get('answers')
+    row['near_duplicate_scenarios'] = near_duplicates.get('scenarios')
+
+    ## token accounting totals (see token_accounting.py)
+    usage_total = (package.get('token_usage') or {}).get('total') or {}
+    row['total_tokens'] = usage_total.get('tokens')
+    row['cost_usd'] = usage_total.get('cost_usd')
+
+    ## number of redacted identifying details, during the interview and in the final package (see pii_redaction.py)
+    redactions = package.get('pii_redactions')
+    row['pii_redactions'] = (
+        sum(sum((redactions.get(stage) or {}).values()) for stage in ['turns', 'package']) if redactions else None
+    )
+
+    ## stages whose model calls were cancelled because an earlier session of the participant disconnected (see cancellation.py)
+    row['cancelled_stages'] = package.get('cancelled_stages')
+
+    ## every generated scenario candidate with its local score (see scenario_ranking.py; not present in older sessions)
+    row['scenario_candidates'] = package.get('scenario_candidates')
+
+    return row
+
+
+def rows_to_table(rows):
+    """Builds a pyarrow table (in SESSION_SCHEMA) from a list of flattened rows."""
+    return pa.Table.from_pylist(rows, schema=SESSION_SCHEMA)
@@ -0,0 +1,103 @@
+"""
+Slot extraction - parallel per-slot extraction of the interview answers
+
+Instead of sending the whole conversation to one `extraction_prompt` call that has to return all four slots,
+the transcript is split at the interview questions, and each slot (`what`, `context`, `outcome`, `reaction`)
+is extracted from its own excerpt with a small `slot_extraction_prompt` call. The four calls run concurrently,
+a malformed answer is retried for that slot only, and a slot that still fails comes back as None.
+
+Each excerpt only holds the turns around its question, so the calls stay small however long the interview gets.
+"""
+
+import re
+
+from langchain_core.prompts import PromptTemplate
+from langchain.output_parsers.json import SimpleJsonOutputParser
+
+from lc_prompts import slot_extraction_prompt, slot_questions
+
+
+SLOTS = ['what', 'context', 'outcome', 'reaction']
+
+# how the interview questions (prompt_datacollection_4o) are recognised in the AI turns, in interview order
+QUESTION_PATTERNS = {
+    'what': re.compile(r'what happened|what (was|were) (said|posted|done)|specific (time|experience|situation)', re.I),
+    'context': re.compile(r'context|what else should (we|i) know|background', re.I),
+    'outcome': re.compile(r'(how did|make you) .*feel|how did you react', re.I),
+    'reaction': re.compile(r'worst', re.I),
+}
+
+_TURN = re.compile(r'^\s*(AI|Human):\s*', re.M)
+
+
+def parse_transcript(transcript):
+    """Turns a transcript into a list of (role, content) pairs.
+
+    Parameters:
+    transcript: a chat message history (e.g. StreamlitChatMessageHistory), a list of (role, content) pairs,
+                or a formatted string with 'AI:' / 'Human:' lines (like test_messages)
+    """
+    if hasattr(transcript, 'messages'):
+        return [(msg.type, msg.content) for msg in transcript.messages]
+    if isinstance(transcript, str):
+        parts = _TURN.split(transcript)
+        # split gives ['', role, content, role, content, ...]
+        return [('ai' if role == 'AI' else 'human', content.strip()) for role, content in zip(parts[1::2], parts[2::2])]
+    return [tuple(turn) for turn in transcript]
+
+
+def split_by_question(turns):
+    """Assigns each part of the conversation to the slot whose question it answers.
+
+    Returns:
+    dict slot -> formatted excerpt (the question turn and the human answers until the next slot question);
+    slots whose question could not be found get the whole conversation
+    """
+    excerpts = {}
+    current = None
+    for role, content in turns:
+        if role == 'ai':
+            # the latest matching question in this AI turn decides the slot (a turn may acknowledge one answer and ask the next question)
+            matches = [(m.start(), slot) for slot, pattern in QUESTION_PATTERNS.items() for m in [pattern.search(content)] if m]
+            if matches:
+                current = max(matches)[1]
+        if current is not None:
+            excerpts.setdefault(current, []).append(f"{'Human' if role == 'human' else 'AI'}: {content}")
+
+    full = '\n'.join(f"{'Human' if role == 'human' else 'AI'}: {content}" for role, content in turns)
+    return {slot: '\n'.join(excerpts[slot]) if excerpts.get(slot) else full for slot in SLOTS}
+
+
+def extract_slots(llm, transcript, config=None, retries=2, canceller=None):
+    """Extracts the four slots concurrently.
+
+    Parameters:
+    llm: chat model used for the extraction
+    transcript: anything parse_transcript accepts
+    config (dict): LangChain run config (e.g. callbacks for token accounting)
+    retries (int): attempts per slot before giving up on it
+    canceller (CallCanceller): runs the calls so they are aborted when the session disconnects (see cancellation.py)
+
+    Returns:
+    dict with `what`, `context`, `outcome` and `reaction` keys (None for slots that could not be extracted)
+    """
+    excerpts = split_by_question(parse_transcript(transcript))
+
+    template = PromptTemplate(input_variables=['slot', 'slot_question', 'conversation_excerpt'], template=slot_extraction_prompt)
+    # a parse error (or API error) only re-runs the call of that slot
+    chain = (template | llm | SimpleJsonOutputParser()).with_retry(stop_after_attempt=retries)
+
+    inputs = [
+        {'slot': slot, 'slot_question': slot_questions[slot], 'conversation_excerpt': excerpts[slot]}
+        for slot in SLOTS
+    ]
+    config = {**(config or {}), 'max_concurrency': len(SLOTS)}
+    if canceller is not None:
+        outputs = canceller.batch(chain, inputs, config=config, stage='extraction', return_exceptions=True)
+    else:
+        outputs = chain.batch(inputs, config=config, return_exceptions=True)
+
+    answers = {}
+    for slot, output in zip(SLOTS, outputs):
+        answers[slot] = output.get(slot) if isinstance(output, dict) else None
+    return answers
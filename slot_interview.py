@@ -0,0 +1,92 @@
+"""
+Slot interview - structured interview turns that fill the answer_set as the conversation goes
+
+With the `interview_mode = "slots"` secret, getData does not run the free-text ConversationChain. Instead, every
+turn goes through `prompt_slot_interview`, which returns a JSON object (OpenAI JSON mode when the interview model
+is an OpenAI one):
+- `reply`: the next message shown to the participant
+- `slot_updates`: the answers (`what`, `context`, `outcome`, `reaction`) the participant's latest message gave
+- `complete`: whether all four questions have been answered
+
+The updates are merged into the session's slots after every turn, so when the interview ends the answer_set is
+already built -- summariseData skips the extraction call, and the interview no longer depends on the model
+writing a "FINISHED" sentinel. The interview is only complete when the model says so *and* all four slots hold an
+answer.
+"""
+
+import json
+
+from langchain_core.messages import get_buffer_string
+from langchain_core.prompts import PromptTemplate
+from langchain.output_parsers.json import SimpleJsonOutputParser
+from langchain_openai import ChatOpenAI
+
+from lc_prompts import prompt_slot_interview
+from slot_extraction import SLOTS
+
+
+# shown when the model's answer can't be parsed (after retries) -- the participant just repeats themselves
+FALLBACK_REPLY = "Sorry, I didn't quite catch that -- could you tell me a bit more?"
+
+
+def empty_slots():
+    return {slot: None for slot in SLOTS}
+
+
+def merge_slots(slots, updates):
+    """Slots with the non-empty updates of known slots applied (later answers replace earlier ones)."""
+    merged = dict(slots)
+    if not isinstance(updates, dict):
+        return merged
+    for slot, value in updates.items():
+        if slot in SLOTS and isinstance(value, str) and value.strip():
+            merged[slot] = value.strip()
+    return merged
+
+
+class SlotInterviewer:
+    """Runs structured interview turns on one chat model.
+
+    Parameters:
+    llm: chat model of the interview stage
+    retries (int): attempts per turn before falling back to FALLBACK_REPLY
+    """
+
+    def __init__(self, llm, retries=2):
+        if isinstance(llm, ChatOpenAI):
+            # JSON mode -- the reply is always a parseable object
+            llm = llm.bind(response_format={"type": "json_object"})
+        template = PromptTemplate(input_variables=['slots', 'history', 'input'], template=prompt_slot_interview)
+        self.chain = (template | llm | SimpleJsonOutputParser()).with_retry(stop_after_attempt=retries)
+
+    def turn(self, history, human, slots, config=None):
+        """One interview turn: asks the model, adds the human message and the reply to the history.
+
+        Parameters:
+        history: chat message history (e.g. StreamlitChatMessageHistory) -- the turns so far
+        human (str): the participant's (already redacted) message
+        slots (dict): the answers collected so far
+        config (dict): LangChain run config (e.g. callbacks for token accounting)
+
+        Returns:
+        dict with `reply`, `slots` (merged) and `complete`
+        """
+        inputs = {
+            'slots': json.dumps(slots, ensure_ascii=False),
+            'history': get_buffer_string(history.messages),
+            'input': human,
+        }
+        try:
+            output = self.chain.invoke(inputs, config=config)
+            if not isinstance(output, dict) or not output.get('reply'):
+                raise ValueError(f"unexpected interview output: {output!r}")
+        except Exception as e:
+            print(f"slot interview turn failed: {e}")
+            output = {'reply': FALLBACK_REPLY, 'slot_updates': {}, 'complete': False}
+
+        merged = merge_slots(slots, output.get('slot_updates'))
+        complete = bool(output.get('complete')) and all(merged.get(slot) for slot in SLOTS)
+
+        history.add_user_message(human)
+        history.add_ai_message(output['reply'])
+        return {'reply': output['reply'], 'slots': merged, 'complete': complete}
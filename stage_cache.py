@@ -0,0 +1,86 @@
+"""
+Stage cache - per-participant results of completed stages, so a reloaded session can resume
+
+A reload (or a dropped connection) gives the participant a new streamlit session with empty session state.
+The stage results of the old session are therefore also kept here, keyed by (chat_id, resume token) -- the token
+is a random value the app adds to the page URL (`?resume=`), so a reload of the same tab finds its entry, but
+someone else opening the app with the same pid does not:
+- 'interview'          : the interview messages so far (updated after every turn)
+- 'slots'              : the answers collected by a 'slots' interview (see slot_interview.py)
+- 'interview_complete' : set once the interview has ended
+- 'extraction'         : the extracted answer_set
+- 'scenarios'          : the shown scenarios with their persona order, example id, candidates and LangSmith run id
+plus the stages whose model calls were cancelled on disconnect (see cancellation.py).
+
+A new session with the same key restores these (see interaction_prototype.py) and skips the stages
+that already ran. Entries are dropped when the session is finalised, after `ttl_seconds`, or when more than
+`max_participants` are cached (least recently used first). The cache lives in the process -- a resumed session
+has to land on the same streamlit worker (sticky sessions).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from pid_index import ANONYMOUS_PIDS
+
+
+class StageCache:
+    """Thread-safe, bounded cache of stage results per (chat_id, resume token) key.
+
+    Parameters:
+    ttl_seconds (float): entries older than this are not restored
+    max_participants (int): max number of keys kept
+    """
+
+    def __init__(self, ttl_seconds=6 * 3600, max_participants=5000):
+        self.ttl_seconds = ttl_seconds
+        self.max_participants = max_participants
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()     # (chat_id, token) -> {'updated': time, 'stages': {...}, 'cancelled': [...]}
+
+    def _entry(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and time.monotonic() - entry['updated'] > self.ttl_seconds:
+            del self.entries[key]
+            entry = None
+        return entry
+
+    def put(self, key, stage, value):
+        if key[0] in ANONYMOUS_PIDS:
+            return
+        with self.lock:
+            entry = self._entry(key) or {'stages': {}, 'cancelled': []}
+            entry['stages'][stage] = value
+            entry['updated'] = time.monotonic()
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_participants:
+                self.entries.popitem(last=False)
+
+    def get(self, key, stage):
+        with self.lock:
+            entry = self._entry(key)
+            return None if entry is None else entry['stages'].get(stage)
+
+    def record_cancel(self, key, stage):
+        """Notes that the model calls of a stage were cancelled because the session disconnected."""
+        if key[0] in ANONYMOUS_PIDS:
+            return
+        with self.lock:
+            entry = self._entry(key) or {'stages': {}, 'cancelled': []}
+            entry['cancelled'].append(stage)
+            entry['updated'] = time.monotonic()
+            self.entries[key] = entry
+
+    def restore(self, key):
+        """Everything cached for a key: {'stages': {...}, 'cancelled': [...]} (None if nothing is cached)."""
+        with self.lock:
+            entry = self._entry(key)
+            if entry is None:
+                return None
+            return {'stages': dict(entry['stages']), 'cancelled': list(entry['cancelled'])}
+
+    def clear(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
@@ -0,0 +1,177 @@
+"""
+Token accounting - per-session token / cost tracking and budget enforcement
+
+Every model call in the app is invoked with a LangChain callback from the session's UsageLedger, tagged
+with the stage it belongs to ('interview', 'extraction', 'scenario', 'adaptation'). The callback reads the
+token usage reported by the model and adds it to the session ledger and to the process-wide totals.
+
+The session totals are stored in the scenario package ('token_usage'), and a Budget decides when a
+session should be degraded to a cheaper model or stop offering AI adaptations.
+"""
+
+import threading
+from decimal import Decimal
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# USD per 1M tokens (input, output) -- keep in sync with the OpenAI price list.
+# Looked up by the longest matching prefix, so dated snapshots (gpt-4o-2024-11-20) get their family's price
+# unless they are listed themselves. Models served by a local OpenAI-compatible server can be added with (0, 0).
+PRICES = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-2024-08-06': (2.50, 10.00),
+    'gpt-4o-2024-05-13': (5.00, 15.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o-mini-2024-07-18': (0.15, 0.60),
+    # the in-process models of local_llm.py
+    'local:': (0.0, 0.0),
+}
+
+# models without a price are charged like the most expensive known one -- so the cost budget still applies
+UNKNOWN_PRICE = max(PRICES.values())
+
+_unknown_models = set()
+_unknown_lock = threading.Lock()
+
+STAGES = ['interview', 'extraction', 'scenario', 'adaptation']
+
+
+def model_price(model):
+    """(input, output) USD per 1M tokens of a model -- by longest matching PRICES prefix, else UNKNOWN_PRICE."""
+    matches = [prefix for prefix in PRICES if model and model.startswith(prefix)]
+    if matches:
+        return PRICES[max(matches, key=len)]
+    with _unknown_lock:
+        first = model not in _unknown_models
+        _unknown_models.add(model)
+    if first:
+        print(f"token accounting: no price for model {model!r}, charging it at {UNKNOWN_PRICE} USD per 1M tokens -- add it to PRICES")
+    return UNKNOWN_PRICE
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Estimated USD cost of one call."""
+    price_in, price_out = model_price(model)
+    return (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+
+
+def _empty_stage():
+    return {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost': 0.0}
+
+
+class UsageLedger:
+    """Thread-safe token / cost totals per stage."""
+
+    def __init__(self, parent=None):
+        self.lock = threading.Lock()
+        self.stages = {}
+        # the process-wide ledger that every session ledger also reports into
+        self.parent = parent
+
+    def add(self, stage, model, prompt_tokens, completion_tokens):
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        with self.lock:
+            totals = self.stages.setdefault(stage, _empty_stage())
+            totals['calls'] += 1
+            totals['prompt_tokens'] += prompt_tokens
+            totals['completion_tokens'] += completion_tokens
+            totals['cost'] += cost
+        if self.parent is not None:
+            self.parent.add(stage, model, prompt_tokens, completion_tokens)
+
+    def callback(self, stage):
+        """LangChain callback handler that books every model call it sees on the given stage."""
+        return UsageCallback(self, stage)
+
+    def calls(self, stage):
+        with self.lock:
+            return self.stages.get(stage, _empty_stage())['calls']
+
+    def total_tokens(self):
+        with self.lock:
+            return sum(s['prompt_tokens'] + s['completion_tokens'] for s in self.stages.values())
+
+    def total_cost(self):
+        with self.lock:
+            return sum(s['cost'] for s in self.stages.values())
+
+    def to_item(self):
+        """Totals in a DynamoDB-friendly form (no floats) for the scenario package."""
+        with self.lock:
+            item = {
+                stage: {
+                    'calls': s['calls'],
+                    'prompt_tokens': s['prompt_tokens'],
+                    'completion_tokens': s['completion_tokens'],
+                    'cost_usd': Decimal(str(round(s['cost'], 6))),
+                }
+                for stage, s in self.stages.items()
+            }
+        item['total'] = {
+            'tokens': self.total_tokens(),
+            'cost_usd': Decimal(str(round(self.total_cost(), 6))),
+        }
+        return item
+
+
+class UsageCallback(BaseCallbackHandler):
+    """Reads the token usage of each finished chat model call and books it on a ledger."""
+
+    def __init__(self, ledger, stage):
+        self.ledger = ledger
+        self.stage = stage
+
+    def on_llm_end(self, response, **kwargs):
+        llm_output = response.llm_output or {}
+        usage = llm_output.get('token_usage') or {}
+        model = llm_output.get('model_name', '')
+
+        prompt_tokens = usage.get('prompt_tokens')
+        completion_tokens = usage.get('completion_tokens')
+
+        ## fall back to the usage metadata on the message (e.g. models that don't fill llm_output)
+        if prompt_tokens is None:
+            prompt_tokens, completion_tokens = 0, 0
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+                    prompt_tokens += metadata.get('input_tokens', 0)
+                    completion_tokens += metadata.get('output_tokens', 0)
+
+        self.ledger.add(self.stage, model, prompt_tokens, completion_tokens or 0)
+
+
+class Budget:
+    """Per-session limits, read from the [budget] section of the streamlit secrets.
+
+    Parameters:
+    max_cost_usd (float): above this estimated session cost, calls are degraded to `fallback_model`
+    max_tokens (int): same, measured in tokens
+    max_adaptation_rounds (int): number of AI adaptation rounds offered in finaliseScenario
+    fallback_model (str): cheaper model used once the session is over budget
+    """
+
+    def __init__(self, max_cost_usd=0.25, max_tokens=60000, max_adaptation_rounds=5, fallback_model='gpt-4o-mini'):
+        self.max_cost_usd = max_cost_usd
+        self.max_tokens = max_tokens
+        self.max_adaptation_rounds = max_adaptation_rounds
+        self.fallback_model = fallback_model
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**{k: v for k, v in dict(config).items() if k in ('max_cost_usd', 'max_tokens', 'max_adaptation_rounds', 'fallback_model')})
+
+    def over_budget(self, ledger):
+        return ledger.total_cost() >= self.max_cost_usd or ledger.total_tokens() >= self.max_tokens
+
+    def adaptations_left(self, ledger):
+        return max(0, self.max_adaptation_rounds - ledger.calls('adaptation'))
+
+    def model_for(self, ledger, model):
+        """The model a session should use next -- the configured one, or the fallback once over budget."""
+        return self.fallback_model if self.over_budget(ledger) else model
+
+
+# totals across all sessions served by this process
+process_ledger = UsageLedger()
@@ -0,0 +1,270 @@
+"""
+Trace spool - sampled LangSmith tracing that never blocks the request path
+
+SpoolingClient is a langsmith Client whose create_run / update_run / create_feedback calls only put the
+operation on a bounded in-memory queue; a background thread uploads them. So a slow or unreachable LangSmith
+costs a session nothing but a queue insert:
+- when the backend fails (connection errors, 5xx, rate limits), operations go to a local JSONL spool instead,
+  and the spool is uploaded (in order, before anything newer) once the backend answers again
+- when the queue is full, operations go straight to the spool; when the spool reaches `spool_max_mb`, they are dropped (and counted)
+
+Sampling is decided per session (the `session_id` metadata set around stateAgent, see interaction_prototype.py):
+a `sample_rate` share of sessions is uploaded. The runs of the other sessions are only held in memory
+(at most `max_held` traces for `hold_seconds`) -- if the participant then gives feedback on a scenario,
+create_feedback promotes the whole trace (tail sampling), so the run_id the feedback points at always exists.
+
+Configured in the [tracing] secrets section, e.g.
+
+    [tracing]
+    enabled = true          # sets LANGCHAIN_TRACING_V2
+    sample_rate = 0.1
+    spool_path = "trace_spool.jsonl"
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+from langsmith import Client
+from langsmith.utils import LangSmithAPIError, LangSmithConnectionError, LangSmithRateLimitError
+
+
+# errors after which the operation is worth retrying later -- anything else (e.g. a 4xx for a bad payload) is dropped
+RETRYABLE = (LangSmithConnectionError, LangSmithAPIError, LangSmithRateLimitError)
+
+# per-attempt timeout of the uploads; retries happen on the background thread anyway
+UPLOAD_TIMEOUT_MS = 10000
+
+
+def _json_default(value):
+    # datetimes as ISO strings (what the API expects), everything else (UUIDs, messages ...) as text.
+    # No attribute probing: some objects in traced inputs / outputs raise on any unknown attribute (e.g. the
+    # st.empty() placeholders summariseData returns raise StreamlitAPIException)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    try:
+        return str(value)
+    except Exception:
+        return f"<unserialisable {type(value).__name__}>"
+
+
+def session_sampled(session_id, sample_rate):
+    """Deterministic per-session decision -- every run of a session (and every process) agrees on it."""
+    if sample_rate >= 1:
+        return True
+    if sample_rate <= 0:
+        return False
+    digest = hashlib.blake2b(str(session_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2**64 < sample_rate
+
+
+class SpoolingClient(Client):
+    """LangSmith client with tail-sampled, buffered, spooled uploads.
+
+    Parameters:
+    sample_rate (float): share of sessions whose traces are uploaded (sessions with feedback are always uploaded)
+    buffer_size (int): max operations waiting in memory for the upload thread
+    spool_path (str): JSONL file for operations that could not be uploaded (yet)
+    spool_max_mb (float): operations are dropped once the spool is this big
+    max_held (int): max traces of unsampled sessions kept in memory for possible promotion
+    hold_seconds (float): how long an unsampled trace can still be promoted by feedback
+    retry_seconds (float): pause after a failed upload before the backend is tried again
+    """
+
+    def __init__(self, sample_rate=1.0, buffer_size=2000, spool_path='trace_spool.jsonl', spool_max_mb=200,
+                 max_held=500, hold_seconds=3600, retry_seconds=30, **client_kwargs):
+        client_kwargs.setdefault('timeout_ms', UPLOAD_TIMEOUT_MS)
+        # the upload thread sends operations one by one -- the client's own batching thread is not needed
+        super().__init__(auto_batch_tracing=False, **client_kwargs)
+        self.sample_rate = sample_rate
+        self.spool_path = spool_path
+        self.spool_max_bytes = spool_max_mb * 2**20
+        self.max_held = max_held
+        self.hold_seconds = hold_seconds
+        self.retry_seconds = retry_seconds
+
+        self.pending = queue.Queue(maxsize=buffer_size)
+        self.lock = threading.Lock()
+        self.spool_lock = threading.Lock()
+        self.trace_kept = {}            # trace id -> sampled?, for the child runs of a trace
+        self.run_traces = {}            # run id -> trace id, so feedback (and updates) find their trace
+        self.held = OrderedDict()       # trace id -> (first seen, [operations]) of unsampled traces
+        self.counts = {'queued': 0, 'held': 0, 'promoted': 0, 'uploaded': 0, 'spooled': 0, 'dropped': 0}
+        self.offline_until = 0.0
+
+        threading.Thread(target=self._upload_loop, name='trace-upload', daemon=True).start()
+
+    @classmethod
+    def from_config(cls, config):
+        keys = ('sample_rate', 'buffer_size', 'spool_path', 'spool_max_mb', 'max_held', 'hold_seconds', 'retry_seconds')
+        return cls(**{k: v for k, v in dict(config).items() if k in keys})
+
+    ## --- request path: only bookkeeping and a queue insert ---
+
+    def create_run(self, name, inputs, run_type, **kwargs):
+        run_id = str(kwargs.get('id') or '')
+        trace_id = str(kwargs.get('trace_id') or run_id)
+        parent = kwargs.get('parent_run_id')
+        with self.lock:
+            if trace_id not in self.trace_kept:
+                # the root run of a trace decides for all its children
+                metadata = (kwargs.get('extra') or {}).get('metadata') or {}
+                session_id = metadata.get('session_id', trace_id) if parent is None else trace_id
+                self.trace_kept[trace_id] = session_sampled(session_id, self.sample_rate)
+                self._forget_old_traces()
+            if run_id:
+                self.run_traces[run_id] = trace_id
+        self._submit(trace_id, ('create_run', {'name': name, 'inputs': inputs, 'run_type': run_type, **kwargs}))
+
+    def update_run(self, run_id, **kwargs):
+        with self.lock:
+            trace_id = str(kwargs.get('trace_id') or self.run_traces.get(str(run_id), run_id))
+        self._submit(trace_id, ('update_run', {'run_id': run_id, **kwargs}))
+
+    def create_feedback(self, run_id, key, **kwargs):
+        """Queues the feedback -- and promotes the trace of `run_id` if its session was not sampled."""
+        self.keep_trace(run_id)
+        self._enqueue(('create_feedback', {'run_id': run_id, 'key': key, **kwargs}))
+
+    def keep_trace(self, run_id):
+        """Makes sure the whole trace containing `run_id` is uploaded."""
+        with self.lock:
+            trace_id = self.run_traces.get(str(run_id), str(run_id))
+            self.trace_kept[trace_id] = True
+            _, operations = self.held.pop(trace_id, (None, []))
+            if operations:
+                self.counts['promoted'] += 1
+        for operation in operations:
+            self._enqueue(operation)
+
+    def stats(self):
+        with self.lock:
+            return {**self.counts, 'pending': self.pending.qsize(), 'held_traces': len(self.held)}
+
+    def _submit(self, trace_id, operation):
+        with self.lock:
+            kept = self.trace_kept.get(trace_id, True)
+            if not kept:
+                if trace_id not in self.held:
+                    self.held[trace_id] = (time.monotonic(), [])
+                self.held[trace_id][1].append(operation)
+                self.counts['held'] += 1
+                return
+        self._enqueue(operation)
+
+    def _enqueue(self, operation):
+        try:
+            self.pending.put_nowait(operation)
+            with self.lock:
+                self.counts['queued'] += 1
+        except queue.Full:
+            self._spool([operation])
+
+    def _forget_old_traces(self):
+        # called with the lock held -- keeps the bookkeeping bounded
+        now = time.monotonic()
+        while self.held:
+            trace_id, (first_seen, _) = next(iter(self.held.items()))
+            if len(self.held) <= self.max_held and now - first_seen <= self.hold_seconds:
+                break
+            del self.held[trace_id]
+        for mapping in (self.trace_kept, self.run_traces):
+            while len(mapping) > 20 * self.max_held:
+                del mapping[next(iter(mapping))]
+
+    ## --- upload thread ---
+
+    def _spool(self, operations):
+        lines = []
+        for op, kwargs in operations:
+            try:
+                lines.append(json.dumps({'op': op, 'kwargs': kwargs}, default=_json_default, ensure_ascii=False) + '\n')
+            except (TypeError, ValueError) as e:
+                # e.g. circular references -- also called from the script thread when the queue is full, so never raise
+                print(f"dropping unserialisable trace operation {op}: {e}")
+                with self.lock:
+                    self.counts['dropped'] += 1
+        with self.spool_lock:
+            size = os.path.getsize(self.spool_path) if os.path.exists(self.spool_path) else 0
+            with open(self.spool_path, 'a') as f:
+                for line in lines:
+                    if size + len(line) > self.spool_max_bytes:
+                        with self.lock:
+                            self.counts['dropped'] += 1
+                        continue
+                    f.write(line)
+                    size += len(line)
+                    with self.lock:
+                        self.counts['spooled'] += 1
+
+    def _send(self, op, kwargs):
+        """Uploads one operation. Returns False if it should be retried later."""
+        try:
+            getattr(super(), op)(**kwargs)
+        except RETRYABLE as e:
+            print(f"trace upload failed, spooling until LangSmith is back: {e}")
+            self.offline_until = time.monotonic() + self.retry_seconds
+            return False
+        except Exception as e:
+            print(f"dropping trace operation {op}: {e}")
+            with self.lock:
+                self.counts['dropped'] += 1
+            return True
+        with self.lock:
+            self.counts['uploaded'] += 1
+        return True
+
+    def _replay_spool(self):
+        """Uploads the spooled operations (oldest first); whatever fails again goes back to the spool."""
+        with self.spool_lock:
+            if not os.path.exists(self.spool_path) or os.path.getsize(self.spool_path) == 0:
+                return True
+            uploading = self.spool_path + '.uploading'
+            os.replace(self.spool_path, uploading)
+
+        with open(uploading) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        for i, entry in enumerate(entries):
+            if not self._send(entry['op'], entry['kwargs']):
+                self._spool([(e['op'], e['kwargs']) for e in entries[i:]])
+                os.remove(uploading)
+                return False
+        os.remove(uploading)
+        return True
+
+    def _upload_loop(self):
+        # an interrupted replay from a previous process is picked up first
+        if os.path.exists(self.spool_path + '.uploading'):
+            with open(self.spool_path + '.uploading') as f:
+                leftover = [(e['op'], e['kwargs']) for e in map(json.loads, filter(str.strip, f))]
+            self._spool(leftover)
+            os.remove(self.spool_path + '.uploading')
+
+        while True:
+            try:
+                operation = self.pending.get(timeout=self.retry_seconds)
+            except queue.Empty:
+                operation = None
+
+            # one bad payload must not stop the uploads of the whole process
+            try:
+                self._upload(operation)
+            except Exception as e:
+                print(f"dropping trace operation {operation[0] if operation else None}: {e}")
+                with self.lock:
+                    self.counts['dropped'] += 1
+
+    def _upload(self, operation):
+        if time.monotonic() < self.offline_until or not self._replay_spool():
+            # backend is down -- keep the newer operations behind the spooled ones
+            if operation is not None:
+                self._spool([operation])
+            return
+
+        if operation is not None and not self._send(*operation):
+            self._spool([operation])